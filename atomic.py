@@ -0,0 +1,16 @@
+"""
+writes files atomically: the data goes to a temporary file next to the target, which is
+renamed into place once it is complete, so that path only ever holds a whole file and an
+interrupted run leaves the previous version (or nothing) behind.
+
+    atomic.save(path, lambda tmp_path : np.save(tmp_path, ids))
+"""
+import os
+
+def save(path, write):
+    """calls write(tmp_path) and renames tmp_path to path.  tmp_path keeps the extension of
+    path, as np.save and np.savez would add theirs to it otherwise"""
+    root, ext = os.path.splitext(path)
+    tmp_path = '%s.tmp%s' % (root, ext)
+    write(tmp_path)
+    os.rename(tmp_path, path)
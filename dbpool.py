@@ -0,0 +1,219 @@
+"""
+shared database helpers for the scripts which query the analytics slaves.  wikis are
+spread over a handful of clusters (s1-s7) and every wiki on a cluster lives on the same
+host, so ConnectionPool keeps connections per cluster and switches between wikis with
+USE <lang>wiki instead of opening a new connection for each one.
+
+usage:
+
+    pool = dbpool.ConnectionPool(cursorclass=SSCursor)
+    for lang in langs:
+        with pool.connection(lang) as conn:
+            cur = conn.cursor()
+            ...
+    pool.close()
+"""
+import os
+import time
+import traceback
+import multiprocessing
+from multiprocessing.queues import SimpleQueue
+from contextlib import contextmanager
+from collections import defaultdict
+
+import MySQLdb
+
+# wikimedia cluster information extracted from http://noc.wikimedia.org/conf/highlight.php?file=db.php
+# NOTE: The default mapping is 's3'
+cluster_mapping = {'enwiki':'s1',
+                'bgwiki':'s2',
+                'bgwiktionary':'s2',
+                'cswiki':'s2',
+                'enwikiquote':'s2',
+                'enwiktionary':'s2',
+                'eowiki':'s2',
+                'fiwiki':'s2',
+                'idwiki':'s2',
+                'itwiki':'s2',
+                'nlwiki':'s2',
+                'nowiki':'s2',
+                'plwiki':'s2',
+                'ptwiki':'s2',
+                'svwiki':'s2',
+                'thwiki':'s2',
+                'trwiki':'s2',
+                'zhwiki':'s2',
+                'commonswiki':'s4',
+                'dewiki':'s5',
+                'frwiki':'s6',
+                'jawiki':'s6',
+                'ruwiki':'s6',
+                'eswiki':'s7',
+                'huwiki':'s7',
+                'hewiki':'s7',
+                'ukwiki':'s7',
+                'frwiktionary':'s7',
+                'metawiki':'s7',
+                'arwiki':'s7',
+                'centralauth':'s7',
+                'cawiki':'s7',
+                'viwiki':'s7',
+                'fawiki':'s7',
+                'rowiki':'s7',
+                'kowiki':'s7'
+              }
+
+def get_cluster(lang):
+    return cluster_mapping.get('%swiki' % lang, 's3')
+
+def get_host_name(cluster):
+    return '%s-analytics-slave.eqiad.wmnet' % cluster
+
+# set in every map_sharded worker, which reports the languages it picks up on it
+started = None
+
+def init_worker(queue):
+    global started
+    started = queue
+
+def call_lang(func, lang, args):
+    started.put((lang, os.getpid()))
+    return func(lang, *args)
+
+def map_sharded(func, langs, args=(), processes=4, shard_limit=4, failed=None):
+    """calls func(lang, *args) for every lang on a pool of processes workers, never running
+    more than shard_limit languages against the same cluster at once.  langs are started in
+    the order given as far as the limits allow.  yields (lang, result) in order of
+    completion.  when func raises or the worker running it dies, the language gives up its
+    slot and yields (lang, failed(lang, error, seconds)) instead, or (lang, None) without
+    failed, and the others carry on"""
+    pending = list(langs)
+    running = defaultdict(int)
+    queue = SimpleQueue()
+    # workers are long lived so that each keeps its own pool connections across languages
+    workers = multiprocessing.Pool(processes, init_worker, (queue,))
+    in_flight = {}
+    pids = {}
+    lost = False
+    while pending or in_flight:
+        for lang in list(pending):
+            if len(in_flight) >= processes:
+                break
+            cluster = get_cluster(lang)
+            if running[cluster] >= shard_limit:
+                continue
+            pending.remove(lang)
+            running[cluster] += 1
+            in_flight[lang] = (time.time(), workers.apply_async(call_lang, (func, lang, tuple(args))))
+
+        while not queue.empty():
+            lang, pid = queue.get()
+            pids[lang] = pid
+        # a dead worker is replaced by the pool, but the task it was running never completes
+        alive = set(worker.pid for worker in workers._pool if worker.exitcode is None)
+        finished = []
+        for lang, (start, result) in in_flight.items():
+            if result.ready():
+                try:
+                    finished.append((lang, result.get(), None))
+                except Exception:
+                    finished.append((lang, None, traceback.format_exc()))
+            elif lang in pids and pids[lang] not in alive:
+                lost = True
+                finished.append((lang, None, 'worker %d died while running %s' % (pids[lang], lang)))
+        if not finished:
+            time.sleep(0.1)
+        for lang, result, error in finished:
+            start, async_result = in_flight.pop(lang)
+            running[get_cluster(lang)] -= 1
+            if error is not None and failed:
+                result = failed(lang, error, time.time() - start)
+            yield lang, result
+    if lost:
+        # the pool waits for the results of lost tasks forever on join
+        workers.terminate()
+    else:
+        workers.close()
+    workers.join()
+
+
+class ConnectionPool(object):
+    """keeps up to max_idle idle connections per cluster.  connections which have been idle
+    for longer than idle_timeout seconds are closed rather than reused, and the rest are
+    pinged before being handed out so that a connection dropped by the server is replaced
+    transparently"""
+
+    def __init__(self, max_idle=2, idle_timeout=300, cursorclass=None):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.cursorclass = cursorclass
+        self.idle = defaultdict(list)
+        self.pid = os.getpid()
+
+    def connect(self, cluster):
+        kwargs = {}
+        if self.cursorclass:
+            kwargs['cursorclass'] = self.cursorclass
+        return MySQLdb.connect(host=get_host_name(cluster),
+                               read_default_file=os.path.expanduser('~/.my.cnf'),
+                               charset='utf8',
+                               use_unicode=True,
+                               **kwargs)
+
+    def checkout(self, cluster):
+        if os.getpid() != self.pid:
+            # connections inherited across a fork share their socket with the parent, so
+            # just forget about them without sending a quit
+            self.idle = defaultdict(list)
+            self.pid = os.getpid()
+        while self.idle[cluster]:
+            conn, last_used = self.idle[cluster].pop()
+            if time.time() - last_used > self.idle_timeout:
+                discard(conn)
+                continue
+            try:
+                conn.ping()
+                return conn
+            except MySQLdb.Error:
+                discard(conn)
+        return self.connect(cluster)
+
+    def checkin(self, conn, cluster):
+        if len(self.idle[cluster]) < self.max_idle:
+            self.idle[cluster].append((conn, time.time()))
+        else:
+            discard(conn)
+
+    def get(self, db):
+        """returns a connection to the cluster holding db, switched over to db"""
+        cluster = cluster_mapping.get(db, 's3')
+        conn = self.checkout(cluster)
+        conn.select_db(db)
+        return conn
+
+    @contextmanager
+    def connection(self, lang, db=None):
+        """yields a connection to <lang>wiki (or db if given) and returns it to the pool
+        afterwards.  a connection which saw an exception may still have an unread
+        streaming result pending, so it is closed instead of being reused"""
+        db = db or '%swiki' % lang
+        cluster = cluster_mapping.get(db, 's3')
+        conn = self.get(db)
+        try:
+            yield conn
+        except:
+            discard(conn)
+            raise
+        self.checkin(conn, cluster)
+
+    def close(self):
+        for cluster, conns in self.idle.items():
+            for conn, last_used in conns:
+                discard(conn)
+        self.idle = defaultdict(list)
+
+def discard(conn):
+    try:
+        conn.close()
+    except MySQLdb.Error:
+        pass
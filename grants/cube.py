@@ -0,0 +1,50 @@
+"""
+sums of several (value, date) column pairs of the grants rows over every combination of a
+set of group columns, computed by a single groupby.  the rows are stacked into one long
+frame of (val_key, date, groups..., value) and summed once; every per-group pivot and
+total is then a roll up of that cube, which has at most as many entries as there are rows,
+so adding group columns costs a wider key rather than another pass over the rows:
+
+    cube = Cube(all_rows, ['By UN region', 'Grant stage'],
+                [('Amount Funded in USD', 'Date of decision')])
+    pt = cube.pivot('Amount Funded in USD', 'By UN region')
+"""
+import pandas as pd
+
+# stands in for a missing group value, which groupby would otherwise drop from every
+# roll up rather than just from the pivot by that group
+MISSING = '__missing__'
+
+
+class Cube(object):
+
+    def __init__(self, rows, group_keys, val_date_keys):
+        self.group_keys = list(group_keys)
+        self.date_keys = dict(val_date_keys)
+        parts = []
+        for val_key, date_key in val_date_keys:
+            part = rows[self.group_keys].fillna(MISSING)
+            part['val_key'] = val_key
+            part['date'] = rows[date_key]
+            part['value'] = rows[val_key]
+            parts.append(part)
+        long_rows = pd.concat(parts, ignore_index=True)
+        self.sums = long_rows.groupby(['val_key', 'date'] + self.group_keys)['value'].sum()
+
+    def pivot(self, val_key, group_key):
+        """(date x group value) sums of val_key, like pivot_table(values=val_key,
+        rows=date_key, cols=group_key, aggfunc=sum).fillna(0)"""
+        sums = self.sums.xs(val_key, level='val_key')
+        # dropped before the roll up, so that a date with no group values is left out
+        # altogether rather than kept as a row of zeros
+        sums = sums[sums.index.get_level_values(group_key) != MISSING]
+        pt = sums.groupby(level=['date', group_key]).sum().unstack(group_key)
+        pt.index.name = self.date_keys[val_key]
+        return pt.fillna(0)
+
+    def total(self, val_key):
+        """one column frame of the sums of val_key per date"""
+        total = pd.DataFrame(self.sums.xs(val_key, level='val_key').groupby(level='date').sum())
+        total.columns = [val_key]
+        total.index.name = self.date_keys[val_key]
+        return total.fillna(0)
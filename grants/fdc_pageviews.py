@@ -1,11 +1,9 @@
 #!/usr/bin/python
-import json
+import time
+import argparse
 import datetime
-import multiprocessing
 from collections import namedtuple
 from dateutil import rrule
-import pandas as pd
-import requests
 import logging
 from sqlalchemy import create_engine, Column, Integer, Boolean, DateTime, String
 from sqlalchemy.orm import sessionmaker
@@ -13,6 +11,9 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.engine.url import URL
 import limnpy
 
+import grok
+import pvstore
+
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 
@@ -43,49 +44,70 @@ class Page(Base):
 
 Batch = namedtuple('Batch', ['name', 'title', 'prefix', 'start', 'end'])
 
+# stats.grok.se project code of meta.wikimedia.org
+project = 'meta.m'
+
 def stats_url_for(page, year, month):
-    return 'http://stats.grok.se/json/meta.m/{0}{1:02d}/{2}'.format(year, month, page.page_title)
+    return grok.stats_url(grok.BASE_URL, project, page.page_title, year, month)
 
 def wiki_url_for(page):
     return 'http://meta.wikimedia.org/wiki/{0}'.format(page.page_title)
 
-def get_pageviews((page, start, end)):
-    pageviews = pd.Series()
-    for d in rrule.rrule(rrule.MONTHLY, dtstart=start, until=end):
-        r = requests.request('GET', stats_url_for(page, d.year, d.month))
-        if r.status_code != 200:
-            logger.warning('received status code %d for page: %s', r.status_code, r.url)
-            continue
-        try:
-            parsed = json.loads(r.text)
-        except ValueError:
-            logger.exception('could not decode JSON:\n%s', r.text)
-            continue
-        month_views_dict = {}
-        for dstr, v in parsed['daily_views'].iteritems():
-            try:
-                date_parsed = datetime.datetime.strptime(dstr, '%Y-%m-%d')
-            except:
-                logger.warning('could not parse date: %s', dstr)
-                continue
-            month_views_dict[date_parsed] = v
-        pageviews = pageviews.append(pd.Series(month_views_dict))
-    return page.page_title, pageviews
-
-def get_batch_pageviews(batch, session):
-    pages = session.query(Page).filter(Page.page_title.startswith(batch.prefix)).all()
+def batch_months(start, end):
+    return [(d.year, d.month) for d in rrule.rrule(rrule.MONTHLY, dtstart=start, until=end)]
+
+def batch_days(start, end):
+    """the first day of start's month up to the first day after end's month"""
+    months = batch_months(start, end)
+    last_year, last_month = months[-1]
+    end_day = datetime.date(last_year + last_month // 12, last_month % 12 + 1, 1)
+    return datetime.date(start.year, start.month, 1), end_day
+
+def get_pageviews(fetcher, store, pages, start, end):
+    """fills the store with the daily views of every page between start and end, with
+    each (page, month) not in the store yet fetched as its own request"""
+    first_day, end_day = batch_days(start, end)
+    store.reserve(first_day, end_day, [(page.page_id, page.page_title) for page in pages])
+    page_ids = dict((page.page_title, page.page_id) for page in pages)
+    month_keys = [(project, page.page_title, year, month)
+                for page in pages
+                for year, month in batch_months(start, end)
+                if not store.is_filled(page.page_id, year, month)]
+    for (_, title, year, month), month_views in fetcher.fetch(month_keys):
+        store.fill(page_ids[title], month_views)
+        # months which are over can not change any more
+        if month_views and grok.month_end(year, month) < time.time():
+            store.mark_filled(page_ids[title], year, month)
+    store.save()
+
+def get_batch_pageviews(batch, session, fetcher, store):
+    # stats.grok.se knows pages by title alone, which is only unique within a namespace
+    pages = session.query(Page).filter(Page.page_namespace == 0,
+                                       Page.page_title.startswith(batch.prefix)).all()
     #pages = pages[:3]
-    args = [(page, batch.start, batch.end) for page in pages]
-    pool = multiprocessing.Pool(50)
-    pageviews_iter = pool.map(get_pageviews, args)
-    #pageviews_iter = map(get_pageviews, args)
-    pageviews = pd.DataFrame.from_dict(dict(pageviews_iter))
+    get_pageviews(fetcher, store, pages, batch.start, batch.end)
+    pages.sort(key=lambda page : page.page_title)
+    pageviews = store.frame([page.page_id for page in pages], *batch_days(batch.start, batch.end))
     print pageviews
     print pageviews.index
     print pageviews.columns
     return pageviews
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='writes limn datasources of the page views of FDC proposal pages',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--cache_dir', default='cache',
+                        help='directory in which to keep the stats.grok.se answers of each page and month')
+    parser.add_argument('--ttl', type=int, default=6 * 3600,
+                        help='seconds for which the cached views of the current month are reused')
+    parser.add_argument('--offline', action='store_true',
+                        help='only use the cached views, making no requests at all')
+    parser.add_argument('--store', default='pageviews',
+                        help='directory of the daily page view matrix shared by all rounds')
+    return vars(parser.parse_args())
+
 def main():
+    opts = parse_args()
     page_batches = [
             Batch('round-1', 
                 'FDC Round 1 Proposal Page Views',
@@ -98,8 +120,10 @@ def main():
                 start=datetime.date(2013,1,1),
                 end=datetime.date(2013,7,1))]
     session = Session()
+    fetcher = grok.Fetcher(cache=grok.ResponseCache(opts['cache_dir'], opts['ttl'], opts['offline']))
+    store = pvstore.PageviewStore(opts['store'])
     for batch in page_batches:
-        df = get_batch_pageviews(batch, session)
+        df = get_batch_pageviews(batch, session, fetcher, store)
         df.to_csv('{0}-pageviews.csv'.format(batch.name))
         ds = limnpy.DataSource(limn_id='fdc-{0}'.format(batch.name),
                 limn_name=batch.title,
@@ -107,6 +131,8 @@ def main():
                 data=df)
         ds.write(basedir='data')
         ds.write_graph(basedir='data')
+    print 'made %d requests' % fetcher.requests
+    fetcher.close()
 
 if __name__ == '__main__':
     main()
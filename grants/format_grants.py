@@ -1,6 +1,5 @@
 import logging
 import argparse
-from pandas import DataFrame
 import pandas as pd
 import itertools
 import xlrd
@@ -12,6 +11,8 @@ import sys
 import limnpy
 import gcat
 
+from cube import Cube
+
 
 root_logger = logging.getLogger()
 ch = logging.StreamHandler()
@@ -79,23 +80,29 @@ def write_limn_files(pt, val_key=None, group_key=None, limn_id=None, limn_name=N
         raise
 
 
-def write_groups(all_rows):
-    group_keys = set(['By UN region',
-                  'Catalyst Program',
-                  'Country of impact (short form)',
-                  'Global South (use)',
-                  'Global South (requestor)',
-                  'By UN region (impact)',
-                  'Grant Status',
-                  'Grant stage']) & set(all_rows.columns)
-    val_date_keys = [('Amount Funded in USD', 'Date of decision'),
-                ('Amount Requested in USD', 'Date opened')]
+GROUP_KEYS = ['By UN region',
+              'Catalyst Program',
+              'Country of impact (short form)',
+              'Global South (use)',
+              'Global South (requestor)',
+              'By UN region (impact)',
+              'Grant Status',
+              'Grant stage']
+
+VAL_DATE_KEYS = [('Amount Funded in USD', 'Date of decision'),
+                 ('Amount Requested in USD', 'Date opened')]
+
+
+def make_cube(all_rows):
+    group_keys = [key for key in GROUP_KEYS if key in all_rows.columns]
+    return Cube(all_rows, group_keys, VAL_DATE_KEYS)
 
+
+def write_groups(cube):
     graphs = []
-    for group_key, (val_key, date_key) in itertools.product(group_keys, val_date_keys):
+    for group_key, (val_key, date_key) in itertools.product(cube.group_keys, VAL_DATE_KEYS):
         logger.debug('grouping by (%s, %s), summed %s', group_key, date_key, val_key)
-        pt = all_rows.pivot_table(values=val_key, rows=date_key, cols=group_key, aggfunc=sum)
-        pt = pt.fillna(0)
+        pt = cube.pivot(val_key, group_key)
         pt_cum = pt.cumsum()
 
         g = write_limn_files(pt, val_key, group_key)
@@ -105,30 +112,25 @@ def write_groups(all_rows):
     return graphs
 
 
-def write_total(all_rows):
-    # req_pt_all = all_rows.pivot_table(values='Amount Requested in USD', rows='Date opened', aggfunc=sum)
-    req_pt_all = pd.DataFrame(all_rows.groupby('Date opened').sum()['Amount Requested in USD'])
-    req_pt_all.columns = ['Amount Requested in USD']
+def write_total(cube):
+    req_pt_all = cube.total('Amount Requested in USD')
     logger.debug('req_pt_all:\n%s', req_pt_all)
-    req_pt_all = req_pt_all.fillna(0)
     req_pt_all_cum = req_pt_all.cumsum()
-    write_limn_files(DataFrame(req_pt_all),
+    write_limn_files(req_pt_all,
                      limn_id='grants_amount_requested_in_usd_all',
                      limn_name='Grants Amount Requested In USD All')
-    write_limn_files(DataFrame(req_pt_all_cum), 
+    write_limn_files(req_pt_all_cum,
                      limn_id='grants_cumulative_amount_requested_in_usd_all',
                      limn_name='Grants Cumulative Amount Requested In USD All')
-    
-    funded_pt_all = pd.DataFrame(all_rows.groupby('Date of decision').sum()['Amount Funded in USD'])
-    funded_pt_all.columns = ['Amount Funded in USD']
-    funded_pt_all = funded_pt_all.fillna(0)
+
+    funded_pt_all = cube.total('Amount Funded in USD')
     funded_pt_all_cum = funded_pt_all.cumsum()
-    g = write_limn_files(DataFrame(funded_pt_all),
-                         limn_id='grants_amount_funded_in_usd_all', 
+    g = write_limn_files(funded_pt_all,
+                         limn_id='grants_amount_funded_in_usd_all',
                          limn_name='Grants Amount Funded In USD All')
-    g_cum = write_limn_files(DataFrame(funded_pt_all_cum), 
-                              limn_id='grants_cumulative_amount_funded_in_usd_all', 
-                              limn_name='Grants Cumulative Amount Funded In USD All')
+    g_cum = write_limn_files(funded_pt_all_cum,
+                             limn_id='grants_cumulative_amount_funded_in_usd_all',
+                             limn_name='Grants Cumulative Amount Funded In USD All')
     return (g, g_cum)
 
 
@@ -161,8 +163,10 @@ def main():
         all_rows = pd.concat([all_rows, rows])
         all_rows = add_global_south(all_rows)
         
-        graphs.extend(write_groups(all_rows))
-        graphs.extend(write_total(all_rows))
+        # every pivot and total below is a roll up of this one aggregation
+        cube = make_cube(all_rows)
+        graphs.extend(write_groups(cube))
+        graphs.extend(write_total(cube))
     
     db = limnpy.Dashboard('grants', 'Wikimedia Grants', 'Dashboard')
     db.add_tab('all', map(lambda g : g.__graph__['id'], graphs))
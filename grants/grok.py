@@ -0,0 +1,187 @@
+"""
+fetches daily page views from stats.grok.se style JSON endpoints
+(<base_url>/json/<project>/<YYYYMM>/<title>, answering {"daily_views": {"2013-01-01": 12, ...}}).
+
+all requests of a Fetcher go through one requests.Session, so connections are kept alive
+and reused, from a pool of `concurrency` threads (the work is waiting on the network,
+which needs neither separate interpreters nor an event loop).  requests are spaced to at
+most `rate` per second over all threads, and connection errors, timeouts, 429s and 5xx
+answers are retried with exponential backoff.  base_url can point at a local stub server.
+
+with a ResponseCache the answers are also kept on disk, one file per (project, title,
+month).  the views of a month can not change once it is over, so an answer fetched after
+the end of its month is used for good, while one for the current month is only reused for
+ttl seconds.  an offline cache serves whatever it has and never goes to the network.
+"""
+import os
+import json
+import time
+import random
+import urllib
+import logging
+import datetime
+import threading
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = 'http://stats.grok.se'
+
+RETRY_STATUS = set([429, 500, 502, 503, 504])
+
+
+def stats_url(base_url, project, title, year, month):
+    return '{0}/json/{1}/{2}{3:02d}/{4}'.format(base_url, project, year, month, title)
+
+def parse_daily_views(parsed):
+    """{datetime : views} of a decoded stats.grok.se answer"""
+    views = {}
+    for dstr, v in parsed.get('daily_views', {}).iteritems():
+        try:
+            date_parsed = datetime.datetime.strptime(dstr, '%Y-%m-%d')
+        except ValueError:
+            logger.warning('could not parse date: %s', dstr)
+            continue
+        views[date_parsed] = v
+    return views
+
+
+class RateLimiter(object):
+    """lets through at most rate calls to wait() per second, across threads"""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def month_end(year, month):
+    """unix time of the start of the month after year, month"""
+    if month == 12:
+        year, month = year + 1, 1
+    else:
+        month += 1
+    return time.mktime(datetime.datetime(year, month, 1).timetuple())
+
+
+class ResponseCache(object):
+
+    def __init__(self, cache_dir, ttl=3600, offline=False):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+
+    def path(self, project, title, year, month):
+        if isinstance(title, unicode):
+            title = title.encode('utf-8')
+        return os.path.join(self.cache_dir, project, '%d%02d' % (year, month), '%s.json' % urllib.quote(title, safe=''))
+
+    def get(self, project, title, year, month):
+        """the cached answer, or None if there is none or it may be out of date"""
+        path = self.path(project, title, year, month)
+        try:
+            fetched = os.path.getmtime(path)
+        except OSError:
+            return None
+        if not self.offline and fetched < month_end(year, month) and time.time() - fetched > self.ttl:
+            return None
+        return json.load(open(path))
+
+    def put(self, project, title, year, month, parsed):
+        path = self.path(project, title, year, month)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # made by another thread in the meantime
+                pass
+        tmp_path = '%s.%d.tmp' % (path, threading.current_thread().ident)
+        json.dump(parsed, open(tmp_path, 'w'))
+        os.rename(tmp_path, path)
+
+
+class Fetcher(object):
+
+    def __init__(self, base_url=BASE_URL, concurrency=16, rate=20, retries=5, backoff=0.5, timeout=30, cache=None):
+        self.cache = cache
+        # number of http requests made, retries included
+        self.requests = 0
+        self.requests_lock = threading.Lock()
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_json(self, url):
+        """the decoded JSON at url, or None if it could not be had"""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random()))
+            self.limiter.wait()
+            with self.requests_lock:
+                self.requests += 1
+            try:
+                r = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning('request for %s failed (attempt %d): %s', url, attempt + 1, e)
+                continue
+            if r.status_code in RETRY_STATUS:
+                logger.warning('received status code %d for %s (attempt %d)', r.status_code, url, attempt + 1)
+                continue
+            if r.status_code != 200:
+                logger.warning('received status code %d for page: %s', r.status_code, url)
+                return None
+            try:
+                return r.json()
+            except ValueError:
+                logger.exception('could not decode JSON:\n%s', r.text)
+                return None
+        logger.error('giving up on %s after %d attempts', url, self.retries + 1)
+        return None
+
+    def month_views(self, project, title, year, month):
+        """{datetime : views} of title in the given month"""
+        parsed = self.cache.get(project, title, year, month) if self.cache else None
+        if parsed is None:
+            if self.cache and self.cache.offline:
+                logger.warning('no cached views of %s for %d-%02d', title, year, month)
+                return {}
+            parsed = self.get_json(stats_url(self.base_url, project, title, year, month))
+            if parsed and self.cache:
+                self.cache.put(project, title, year, month, parsed)
+        return parse_daily_views(parsed) if parsed else {}
+
+    def fetch(self, requests_):
+        """fetches the (project, title, year, month) tuples of requests_ concurrently.
+        yields ((project, title, year, month), {datetime : views}) as they complete"""
+        def fetch_one(key):
+            return key, self.month_views(*key)
+        pool = ThreadPool(self.concurrency)
+        try:
+            for result in pool.imap_unordered(fetch_one, requests_):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def close(self):
+        self.session.close()
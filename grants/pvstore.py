@@ -0,0 +1,112 @@
+"""
+columnar store of daily page views: a dense int32 (day x page) matrix saved as
+<path>/views.npy and memory mapped on load, with <path>/meta.json holding
+
+    start       the date of row 0
+    page_ids    the page id of each column
+    titles      {page id : title}
+    filled      [page id, YYYYMM] of the months which are over and have been fetched
+
+days with no views recorded hold MISSING.  reserve() grows the matrix to cover a batch's
+pages and date range before it is fetched, copying the old block into place, so that a
+store can be shared by every round and later batches only add to it.
+"""
+import os
+import json
+import datetime
+
+import numpy as np
+import pandas as pd
+
+MISSING = -1
+
+
+class PageviewStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.meta_path = os.path.join(path, 'meta.json')
+        self.views_path = os.path.join(path, 'views.npy')
+        if os.path.exists(self.meta_path):
+            meta = json.load(open(self.meta_path))
+            self.start = datetime.datetime.strptime(meta['start'], '%Y-%m-%d').date()
+            self.page_ids = meta['page_ids']
+            self.titles = dict((int(page_id), title) for page_id, title in meta['titles'].items())
+            self.filled = set(tuple(item) for item in meta['filled'])
+            self.views = np.load(self.views_path, mmap_mode='r+')
+        else:
+            self.start = None
+            self.page_ids = []
+            self.titles = {}
+            self.filled = set()
+            self.views = np.zeros((0, 0), dtype=np.int32)
+        self.columns = dict((page_id, i) for i, page_id in enumerate(self.page_ids))
+
+    @property
+    def end(self):
+        """the day after the last row"""
+        return self.start + datetime.timedelta(days=len(self.views)) if self.start else None
+
+    def reserve(self, start, end, pages):
+        """makes room for the days from start up to (not including) end and for the
+        (page id, title) pairs of pages"""
+        for page_id, title in pages:
+            self.titles[page_id] = title
+        new_pages = [page_id for page_id, title in pages if page_id not in self.columns]
+        new_start = min(start, self.start) if self.start else start
+        new_end = max(end, self.end) if self.start else end
+        if not new_pages and new_start == self.start and new_end == self.end:
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp_path = '%s.tmp.npy' % self.views_path[:-len('.npy')]
+        shape = ((new_end - new_start).days, len(self.page_ids) + len(new_pages))
+        views = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int32, shape=shape)
+        views[:] = MISSING
+        if self.start:
+            offset = (self.start - new_start).days
+            views[offset:offset + len(self.views), :len(self.page_ids)] = self.views
+        views.flush()
+        del views
+        os.rename(tmp_path, self.views_path)
+        self.start = new_start
+        self.page_ids = self.page_ids + new_pages
+        self.columns = dict((page_id, i) for i, page_id in enumerate(self.page_ids))
+        self.views = np.load(self.views_path, mmap_mode='r+')
+        self.save()
+
+    def fill(self, page_id, views):
+        """writes the {datetime : views} of a page into its column"""
+        if not views:
+            return
+        days = sorted(views)
+        rows = np.array([(day.date() - self.start).days for day in days])
+        self.views[rows, self.columns[page_id]] = [views[day] for day in days]
+
+    def mark_filled(self, page_id, year, month):
+        self.filled.add((page_id, '%d%02d' % (year, month)))
+
+    def is_filled(self, page_id, year, month):
+        return (page_id, '%d%02d' % (year, month)) in self.filled
+
+    def save(self):
+        if isinstance(self.views, np.memmap):
+            self.views.flush()
+        meta = {'start' : self.start.strftime('%Y-%m-%d'),
+                'page_ids' : self.page_ids,
+                'titles' : dict((str(page_id), title) for page_id, title in self.titles.items()),
+                'filled' : sorted(self.filled)}
+        tmp_path = '%s.tmp' % self.meta_path
+        json.dump(meta, open(tmp_path, 'w'))
+        os.rename(tmp_path, self.meta_path)
+
+    def frame(self, page_ids, start, end):
+        """(date x page title) frame of the views of page_ids from start up to end, with
+        the days on which none of them has any views left out"""
+        first = (start - self.start).days
+        rows = slice(first, first + (end - start).days)
+        block = self.views[rows, [self.columns[page_id] for page_id in page_ids]]
+        index = pd.date_range(start, periods=block.shape[0], freq='D')
+        df = pd.DataFrame(np.where(block == MISSING, np.nan, block), index=index,
+                          columns=[self.titles[page_id] for page_id in page_ids])
+        return df.dropna(how='all')
@@ -0,0 +1,43 @@
+"""
+checks the roll ups of Cube against sums done by hand:
+
+    py.test test_cube.py
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from cube import Cube
+
+D1, D2, D3 = datetime.datetime(2012, 1, 1), datetime.datetime(2012, 2, 1), datetime.datetime(2012, 3, 1)
+
+def grants():
+    return pd.DataFrame({'By UN region' : ['Africa', 'Europe', 'Africa', np.nan, np.nan],
+                         'Grant stage' : ['Complete', 'Complete', 'Open', 'Open', np.nan],
+                         'Amount Funded in USD' : [10.0, 20.0, 5.0, 7.0, 3.0],
+                         'Date of decision' : [D1, D1, D2, D3, D3]})
+
+def make_cube():
+    return Cube(grants(), ['By UN region', 'Grant stage'], [('Amount Funded in USD', 'Date of decision')])
+
+def test_pivot():
+    pt = make_cube().pivot('Amount Funded in USD', 'By UN region')
+    assert pt.index.name == 'Date of decision'
+    assert list(pt.columns) == ['Africa', 'Europe']
+    assert list(pt.index) == [D1, D2]
+    assert pt.values.tolist() == [[10.0, 20.0], [5.0, 0.0]]
+
+def test_pivot_drops_dates_without_group_values():
+    # D3 only has rows with no UN region, which pivot_table leaves out
+    pt = make_cube().pivot('Amount Funded in USD', 'By UN region')
+    assert D3 not in pt.index
+    pt = make_cube().pivot('Amount Funded in USD', 'Grant stage')
+    assert list(pt.index) == [D1, D2, D3]
+    assert pt.values.tolist() == [[30.0, 0.0], [0.0, 5.0], [0.0, 7.0]]
+
+def test_total():
+    total = make_cube().total('Amount Funded in USD')
+    assert list(total.columns) == ['Amount Funded in USD']
+    assert list(total.index) == [D1, D2, D3]
+    assert total['Amount Funded in USD'].tolist() == [30.0, 5.0, 10.0]
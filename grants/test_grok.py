@@ -0,0 +1,91 @@
+"""
+runs the Fetcher against a stub stats.grok.se on localhost:
+
+    py.test test_grok.py
+"""
+import json
+import datetime
+import threading
+from collections import defaultdict
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import grok
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep alive, so that the fetcher can reuse its connections
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] += 1
+            server.connections.add(self.client_address)
+            attempt = server.requests[self.path]
+        title = self.path.rsplit('/', 1)[-1]
+        if title == 'Missing':
+            self.answer(404, 'not found')
+        elif title == 'Flaky' and attempt <= 2:
+            self.answer(503, 'try again')
+        else:
+            self.answer(200, json.dumps({'daily_views' : {'2013-01-01' : 3, '2013-01-02' : 5}}))
+
+    def answer(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.connections = set()
+
+
+def run_stub(test):
+    server = StubServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    fetcher = grok.Fetcher('http://127.0.0.1:%d' % server.server_address[1], concurrency=1,
+                           rate=None, backoff=0, timeout=5)
+    try:
+        test(server, fetcher)
+    finally:
+        fetcher.close()
+        server.shutdown()
+        server.server_close()
+
+def test_retries_unavailable():
+    def test(server, fetcher):
+        views = fetcher.month_views('meta.m', 'Flaky', 2013, 1)
+        assert views == {datetime.datetime(2013, 1, 1) : 3, datetime.datetime(2013, 1, 2) : 5}
+        assert server.requests['/json/meta.m/201301/Flaky'] == 3
+        assert fetcher.requests == 3
+    run_stub(test)
+
+def test_missing_month_is_empty():
+    def test(server, fetcher):
+        assert fetcher.month_views('meta.m', 'Missing', 2013, 1) == {}
+        # a 404 is not retried
+        assert server.requests['/json/meta.m/201301/Missing'] == 1
+    run_stub(test)
+
+def test_reuses_connections():
+    def test(server, fetcher):
+        keys = [('meta.m', 'Page_%d' % i, 2013, month) for i in range(5) for month in (1, 2)]
+        results = dict(fetcher.fetch(keys))
+        assert sorted(results) == sorted(keys)
+        assert all(len(views) == 2 for views in results.values())
+        assert sum(server.requests.values()) == len(keys)
+        assert len(server.connections) == 1
+    run_stub(test)
@@ -0,0 +1,75 @@
+"""
+registry of the project groups defined by the data/*.tsv files (one project id per line,
+optionally followed by a tab and its name).  a group is named after its file without the
+_ids suffix, e.g. data/catalyst_ids.tsv is the catalyst group, except where PREFIXES keeps
+an older datasource prefix.  the files in NOT_GROUPS list every project rather than a
+group, and are left out.
+
+group totals are computed for every group at once by multiplying a (date x project)
+frame with the 0/1 (project x group) membership matrix, so that adding a group adds a
+column to one matrix product rather than another slice-and-sum per metric.
+"""
+import os
+import glob
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# datasource prefixes already published under another name
+PREFIXES = {'indic_lang' : 'indic_language'}
+
+# lists of every project, e.g. the languages unique_editors extracts by default
+NOT_GROUPS = set(['all_ids.tsv'])
+
+def group_name(path):
+    name = os.path.basename(path)[:-len('.tsv')]
+    if name.endswith('_ids'):
+        name = name[:-len('_ids')]
+    return PREFIXES.get(name, name)
+
+def load_group(path):
+    ids = pd.read_table(path, sep='\t', comment='#', header=None, names=['id', 'name'])['id']
+    return ids.dropna().astype(str).unique()
+
+def load_groups(data_dir=DATA_DIR):
+    """returns {group name : array of its unique project ids} for every tsv in data_dir
+    except NOT_GROUPS"""
+    return OrderedDict((group_name(path), load_group(path))
+                       for path in sorted(glob.glob(os.path.join(data_dir, '*.tsv')))
+                       if os.path.basename(path) not in NOT_GROUPS)
+
+def members(groups, projects):
+    """the projects of each group which are in projects, in the order of the group file"""
+    projects = set(projects)
+    return OrderedDict((name, [project for project in ids if project in projects])
+                       for name, ids in groups.items())
+
+def membership(groups, projects):
+    """the (len(projects) x len(groups)) 0/1 matrix of which project is in which group"""
+    index = dict((project, i) for i, project in enumerate(projects))
+    matrix = np.zeros((len(projects), len(groups)))
+    for j, ids in enumerate(groups.values()):
+        rows = [index[project] for project in ids if project in index]
+        matrix[rows, j] = 1
+    return matrix
+
+def totals(df, groups):
+    """(date x group) frame of the sum of the projects of each group in the (date x
+    project) frame df.  missing values count as 0, like DataFrame.sum"""
+    matrix = membership(groups, list(df.columns))
+    values = np.nan_to_num(df.values.astype(np.float64)).dot(matrix)
+    return pd.DataFrame(values, index=df.index, columns=list(groups.keys()))
+
+def block_totals(block, val_keys, groups):
+    """totals of every group for every val_key of a date x (val_key, project) block, in one
+    product.  returns {val_key : (date x group) frame}"""
+    projects = list(block[val_keys[0]].columns)
+    matrix = membership(groups, projects)
+    columns = pd.MultiIndex.from_product([val_keys, projects])
+    values = block.reindex(columns=columns).values.astype(np.float64).reshape(len(block), len(val_keys), len(projects))
+    sums = np.nan_to_num(values).dot(matrix)
+    return dict((val_key, pd.DataFrame(sums[:, i, :], index=block.index, columns=list(groups.keys())))
+                for i, val_key in enumerate(val_keys))
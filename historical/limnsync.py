@@ -0,0 +1,109 @@
+"""
+change aware limn writes.  a datasource is rendered by limnpy into a scratch directory and
+each file it produced is then compared with the one already under basedir:
+
+    unchanged   identical bytes, the file is not touched (so keeps its mtime)
+    appended    the old file is a prefix of the new one, e.g. a datafile which just
+                gained the rows of a new month, so only the new tail is appended
+    rewritten   anything else (history changed, a new column, ...), replaced atomically
+    created     no file yet
+
+usage:
+
+    with limnsync.synced(basedir) as (tmpdir, statuses):
+        ds.write(tmpdir)
+        ds.write_graph(cols, basedir=tmpdir)
+
+or, for a batch of (limn_id, df, graph cols) datasources written on a process pool:
+
+    limnsync.write_datasources(jobs, basedir, processes=4)
+"""
+import os
+import shutil
+import tempfile
+import collections
+import multiprocessing
+from contextlib import contextmanager
+
+import limnpy
+
+
+def sync_file(src, dst):
+    """brings dst up to date with src, returning what had to be done"""
+    new = open(src, 'rb').read()
+    if os.path.exists(dst):
+        if os.path.getsize(dst) <= len(new):
+            old = open(dst, 'rb').read()
+            if old == new:
+                return 'unchanged'
+            if new.startswith(old) and old.endswith(b'\n'):
+                f = open(dst, 'ab')
+                f.write(new[len(old):])
+                f.close()
+                return 'appended'
+        status = 'rewritten'
+    else:
+        status = 'created'
+    dst_dir = os.path.dirname(dst)
+    if dst_dir and not os.path.isdir(dst_dir):
+        os.makedirs(dst_dir)
+    tmp_path = '%s.tmp' % dst
+    f = open(tmp_path, 'wb')
+    f.write(new)
+    f.close()
+    os.rename(tmp_path, dst)
+    return status
+
+def sync_tree(src_dir, dst_dir):
+    """syncs every file under src_dir to the same relative path under dst_dir.  returns
+    {relative path : status}"""
+    statuses = {}
+    for root, dirs, files in os.walk(src_dir):
+        for name in files:
+            rel_path = os.path.relpath(os.path.join(root, name), src_dir)
+            statuses[rel_path] = sync_file(os.path.join(src_dir, rel_path), os.path.join(dst_dir, rel_path))
+    return statuses
+
+@contextmanager
+def synced(basedir):
+    """yields (tmpdir, statuses): whatever is written under tmpdir in the block is synced to
+    basedir afterwards, and statuses filled in with the result of each file"""
+    tmpdir = tempfile.mkdtemp(prefix='limnsync')
+    statuses = {}
+    try:
+        yield tmpdir, statuses
+        statuses.update(sync_tree(tmpdir, basedir))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def write_datasource(job):
+    """writes the datasource of a (limn_id, df, graph_cols, basedir, incremental) job, and
+    its graph unless graph_cols is None.  returns (limn_id, {relative path : status}),
+    with no statuses unless incremental"""
+    limn_id, df, graph_cols, basedir, incremental = job
+    limn_title = limn_id.replace('_', ' ').title()
+    ds = limnpy.DataSource(limn_id, limn_title, df)
+    if not incremental:
+        ds.write(basedir)
+        if graph_cols is not None:
+            ds.write_graph(graph_cols, basedir=basedir)
+        return limn_id, {}
+    with synced(basedir) as (tmpdir, statuses):
+        ds.write(tmpdir)
+        if graph_cols is not None:
+            ds.write_graph(graph_cols, basedir=tmpdir)
+    return limn_id, statuses
+
+def write_datasources(jobs, basedir, processes=4, incremental=True):
+    """writes the (limn_id, df, graph_cols) jobs to basedir on a pool of processes workers,
+    printing the status of the files of each datasource as it is done.  with incremental
+    only the files which changed are touched"""
+    pool = multiprocessing.Pool(processes)
+    counts = collections.Counter()
+    for limn_id, statuses in pool.imap_unordered(write_datasource, [tuple(job) + (basedir, incremental) for job in jobs]):
+        counts.update(statuses.values())
+        print 'wrote %s %s' % (limn_id, ' '.join('%s:%s' % item for item in sorted(statuses.items())))
+    pool.close()
+    pool.join()
+    if incremental:
+        print ', '.join('%d %s' % (n, status) for status, n in sorted(counts.items()))
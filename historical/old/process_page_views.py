@@ -1,20 +1,43 @@
+import os, sys
 import pandas as pd
 import csv
 import limnpy
 import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import wikistats
+import pagecounts
+
 basedir = '/home/erosen/src/dashboard/historical/data'
+# parsed columns of the wikistats csvs, reused until the csv changes
+cache_dir = 'cache'
 
 
 pv_fn='/a/wikistats_git/dumps/csv/csv_wp/PageViewsPerMonthAll.csv'
 
+# directory of hourly pagecounts-YYYYMMDD-HHMMSS.gz files to count the views from instead
+# of pv_fn.  the daily counts are kept in pagecounts_store, so each run only reads the
+# files added since the last one
+pagecounts_dir = None
+pagecounts_store = os.path.join(cache_dir, 'pagecounts.npz')
+processes = 4
+
 fieldnames = ['project',
               'date',
               'page_views']
 
 val_keys = ['page_views']
 
-df_long = pd.read_table(pv_fn, sep=',', header=None, parse_dates=['date'], names=fieldnames)
+if pagecounts_dir:
+    store = pagecounts.load(pagecounts_store)
+    if pagecounts.ingest(pagecounts_dir, store, processes):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        pagecounts.save(store, pagecounts_store)
+    df_long = store.monthly()
+else:
+    df_long = wikistats.read_csv(pv_fn, fieldnames, ['project', 'date'] + val_keys, cache_dir)
 
 print df_long
 
@@ -0,0 +1,133 @@
+"""
+counts page views per project and day straight from the hourly pagecounts-raw dumps
+(pagecounts-YYYYMMDD-HHMMSS.gz, one `project title views bytes` line per page), as the
+input of process_page_views.py instead of the precomputed PageViewsPerMonthAll.csv.
+
+each file is decompressed as a stream and only the per-project sums of that hour are
+kept, so a worker needs a few hundred KB whatever the size of the file, and the files are
+spread over a process pool.  the sums go into a DailyViews store, a (day x project) int64
+array saved as an npz along with the names of the files already counted, so that a rerun
+only reads the hours added since.
+"""
+import io
+import os
+import re
+import gzip
+import glob
+import multiprocessing
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+import atomic
+
+FILE_RE = re.compile(r'pagecounts-(\d{8})-\d{6}\.gz$')
+
+
+def file_day(path):
+    """YYYYMMDD int of the hour a pagecounts file covers"""
+    return int(FILE_RE.search(os.path.basename(path)).group(1))
+
+def is_wikipedia(project):
+    # other projects carry a suffix, e.g. en.b for the english wikibooks or en.mw for
+    # the english mobile site
+    return '.' not in project
+
+def count_file(path):
+    """returns (file name, day, {project : views}) of one hourly file.  the lines of a
+    file are sorted by project, so the sum of a project is only looked up once per run
+    of its lines"""
+    counts = defaultdict(int)
+    project, views = None, 0
+    f = io.BufferedReader(gzip.open(path, 'rb'))
+    for line in f:
+        fields = line.split(b' ')
+        if len(fields) != 4:
+            continue
+        if fields[0] != project:
+            if project is not None:
+                counts[project] += views
+            project, views = fields[0], 0
+        try:
+            views += int(fields[2])
+        except ValueError:
+            pass
+    if project is not None:
+        counts[project] += views
+    f.close()
+    return os.path.basename(path), file_day(path), dict(counts)
+
+
+class DailyViews(object):
+    """views per day (sorted YYYYMMDD ints) and project"""
+
+    def __init__(self, days=None, projects=None, views=None, files=None):
+        self.days = np.zeros(0, dtype=np.int32) if days is None else np.asarray(days, dtype=np.int32)
+        self.projects = [] if projects is None else list(projects)
+        self.views = np.zeros((len(self.days), len(self.projects)), dtype=np.int64) if views is None else views
+        self.files = set() if files is None else set(files)
+        self.columns = dict((project, i) for i, project in enumerate(self.projects))
+
+    def day_row(self, day):
+        row = np.searchsorted(self.days, day)
+        if row == len(self.days) or self.days[row] != day:
+            self.days = np.insert(self.days, row, day)
+            self.views = np.insert(self.views, row, 0, axis=0)
+        return row
+
+    def project_columns(self, projects):
+        new = [project for project in projects if project not in self.columns]
+        if new:
+            for project in new:
+                self.columns[project] = len(self.projects)
+                self.projects.append(project)
+            self.views = np.hstack([self.views, np.zeros((len(self.days), len(new)), dtype=np.int64)])
+        return [self.columns[project] for project in projects]
+
+    def add(self, name, day, counts):
+        projects = counts.keys()
+        columns = self.project_columns(projects)
+        row = self.day_row(day)
+        self.views[row, columns] += np.fromiter((counts[project] for project in projects),
+                                                dtype=np.int64, count=len(projects))
+        self.files.add(name)
+
+    def monthly(self):
+        """long frame of project, date (the last day of the month, as in the wikistats
+        csvs) and page_views"""
+        months = self.days // 100
+        starts = np.flatnonzero(np.concatenate([[True], months[1:] != months[:-1]])) if len(months) else []
+        sums = np.add.reduceat(self.views, starts, axis=0) if len(starts) else self.views
+        month_starts = np.array(['%04d-%02d' % (m // 100, m % 100) for m in months[starts]], dtype='datetime64[M]')
+        month_ends = (month_starts + 1).astype('datetime64[D]') - 1
+        df = pd.DataFrame(sums, index=pd.Index(month_ends.astype('datetime64[ns]'), name='date'),
+                          columns=pd.Index(self.projects, name='project'))
+        return df.stack().reset_index(name='page_views')[['project', 'date', 'page_views']]
+
+
+def save(store, path):
+    atomic.save(path, lambda tmp_path : np.savez(tmp_path, days=store.days, projects=np.array(store.projects, dtype=str),
+                                                 views=store.views, files=np.array(sorted(store.files), dtype=str)))
+
+def load(path):
+    if not os.path.exists(path):
+        return DailyViews()
+    data = np.load(path)
+    return DailyViews(data['days'], list(data['projects']), data['views'], list(data['files']))
+
+def ingest(pagecounts_dir, store, processes=4, keep=is_wikipedia):
+    """counts every pagecounts file in pagecounts_dir which store has not seen yet into
+    store, keeping the projects for which keep is true.  returns the number of files read"""
+    paths = [path for path in sorted(glob.glob(os.path.join(pagecounts_dir, 'pagecounts-*.gz')))
+             if FILE_RE.search(path) and os.path.basename(path) not in store.files]
+    if not paths:
+        return 0
+    pool = multiprocessing.Pool(processes)
+    for i, (name, day, counts) in enumerate(pool.imap_unordered(count_file, paths)):
+        store.add(name, day, dict((project, views) for project, views in counts.items() if keep(project)))
+        if (i + 1) % 100 == 0:
+            print 'counted %d of %d pagecounts files' % (i + 1, len(paths))
+    pool.close()
+    pool.join()
+    return len(paths)
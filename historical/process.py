@@ -1,9 +1,20 @@
-import pandas as pd
+import os, sys
 import csv
-import limnpy
 import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import groups as group_registry
+import wikistats
+import limnsync
+
 basedir = '/home/erosen/src/dashboard/historical/data'
+# parsed columns of the wikistats csvs, reused until the csv changes
+cache_dir = 'cache'
+# number of datasources written concurrently
+processes = 4
+# only touch the datafiles which changed since the last run, appending the new months
+# where that is all that changed, instead of rewriting every file
+incremental = True
 
 
 # stats_fn='/a/wikistats/csv/csv_wp/StatisticsMonthly.csv'
@@ -45,29 +56,29 @@ val_keys = ['total_editors',
               'num_links_external',
               'num_links_redirects']
 
-df_long = pd.read_table(stats_fn, sep=',', header=None, parse_dates=['date'], names=fieldnames)
+df_long = wikistats.read_csv(stats_fn, fieldnames, ['project', 'date'] + val_keys, cache_dir)
 
 print df_long
 
-indic_lang_df = pd.read_table('../data/indic_lang_ids.tsv', sep='\t', comment='#', names=['id','name'])
-indic_langs = indic_lang_df['id'].dropna().unique()
+# each group in ../data/*.tsv gets a <group>_<val_key> datasource of its projects plus
+# their total
+groups = group_registry.load_groups()
 
-for val_key in val_keys:
-    print 'processing val_key: %s' % val_key
-    df = df_long.pivot(index='date', columns='project', values=val_key)
-    # print pt
-    limn_id = 'overall_%s' % val_key
-    limn_title = limn_id.replace('_', ' ').title()
-    ds = limnpy.DataSource(limn_id, limn_title,df)
-    ds.write(basedir)
+# a single reshape into a (date x (val_key, project)) block, from which every datasource
+# below is just a column selection
+block = df_long.set_index(['date', 'project'])[val_keys].unstack('project')
 
+# the totals of every group for every val_key come out of a single matrix product
+totals = group_registry.block_totals(block, val_keys, groups)
+group_members = group_registry.members(groups, block[val_keys[0]].columns)
 
+jobs = []
+for val_key in val_keys:
+    df = block[val_key]
+    jobs.append(('overall_%s' % val_key, df, None))
+    for prefix, langs in group_members.items():
+        group_df = df[langs]
+        group_df['Total'] = totals[val_key][prefix]
+        jobs.append(('%s_%s' % (prefix, val_key), group_df, langs))
 
-    indic_df = df[indic_langs]
-    indic_df['Total'] = indic_df.sum(axis=1)
-    indic_limn_id = 'indic_language_%s' % val_key
-    indic_limn_title = indic_limn_id.replace('_', ' ').title()
-    indic_ds = limnpy.DataSource(indic_limn_id, indic_limn_title, indic_df)
-    # print indic_pt
-    indic_ds.write(basedir)
-    indic_ds.write_graph(indic_langs, basedir=basedir)
+limnsync.write_datasources(jobs, basedir, processes, incremental)
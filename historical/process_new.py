@@ -1,79 +1,47 @@
-import pandas as pd
+import os, sys
 import csv
-import limnpy
 import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import groups as group_registry
+import wikistats
+import limnsync
+
 basedir = '/home/erosen/src/dashboard/historical/data'
+# number of datasources written concurrently
+processes = 4
+# only touch the datafiles which changed since the last run
+incremental = True
 
 stats_fn='/a/wikistats_git/dumps/csv/csv_wp/StatisticsUserActivitySpread.csv'
 
-fieldnames = ['
-        1  3  5  10  25  100  250  1000  2500  10000  25000           #Articles Users
-              5  10      100       1000        10000         100000   #Articles Bots 
-        1  3  5  10  25  100  250  1000  2500  10000  25000  100000   #Talk Users
-              5  10      100       1000        10000         100000   #Talk Bots
-        1  3  5  10  25  100  250  1000  2500  10000  25000           #Other Users 
-              5  10      100       1000        10000         100000'] #Other Bots
-
-fieldnames = ['project',
-              'date',
-              'total_editors',
-              'new_editors',
-              'active_editors', 
-              'very_active_editors',
-              'num_articles',
-              'num_articles_200',
-              'new_articles_per_day', 
-              'mean_edits',
-              'mean_bytes', 
-              'larger_than_0.5kb', 
-              'larger_than_2kb',
-              'db_num_edits', 
-              'db_size', 
-              'db_num_words', 
-              'num_links_internal', 
-              'num_links_interwiki',
-              'num_links_image', 
-              'num_links_external',
-              'num_links_redirects'] + range(8)
+# one datasource per namespace group, user kind and edit count threshold, e.g.
+# indic_language_articles_users_5 for the users with at least 5 article edits
+val_keys = wikistats.ACTIVITY_COLUMNS
 
-val_keys = ['total_editors',
-              'new_editors',
-              'active_editors', 
-              'very_active_editors',
-              'num_articles',
-              'new_articles_per_day', 
-              'mean_edits',
-              'db_size',
-              'num_links_internal', 
-              'num_links_interwiki',
-              'num_links_image', 
-              'num_links_external',
-              'num_links_redirects']
+# each group in ../data/*.tsv gets a <group>_<val_key> datasource of its projects plus
+# their total
+groups = group_registry.load_groups()
 
-df_long = pd.read_table(stats_fn, sep=',', header=None, parse_dates=['date'], names=fieldnames)
+# the file is streamed in chunks keeping just the rows of projects in some group
+projects = set()
+for langs in groups.values():
+    projects.update(langs)
+df_long = wikistats.read_activity_spread(stats_fn, projects)
 
 print df_long
 
-indic_lang_df = pd.read_table('../data/indic_lang_ids.tsv', sep='\t', comment='#', names=['id','name'])
-indic_langs = indic_lang_df['id'].dropna().unique()
+block = df_long.set_index(['date', 'project'])[val_keys].unstack('project')
+# the totals of every group for every val_key come out of a single matrix product
+totals = group_registry.block_totals(block, val_keys, groups)
+group_members = group_registry.members(groups, block[val_keys[0]].columns)
 
+jobs = []
 for val_key in val_keys:
-    print 'processing val_key: %s' % val_key
-    df = df_long.pivot(index='date', columns='project', values=val_key)
-    # print pt
-    limn_id = 'overall_%s' % val_key
-    limn_title = limn_id.replace('_', ' ').title()
-    ds = limnpy.DataSource(limn_id, limn_title,df)
-    ds.write(basedir)
-
-
+    df = block[val_key]
+    for prefix, langs in group_members.items():
+        group_df = df[langs]
+        group_df['Total'] = totals[val_key][prefix]
+        jobs.append(('%s_%s' % (prefix, val_key), group_df, langs))
 
-    indic_df = df[indic_langs]
-    indic_df['Total'] = indic_df.sum(axis=1)
-    indic_limn_id = 'indic_language_%s' % val_key
-    indic_limn_title = indic_limn_id.replace('_', ' ').title()
-    indic_ds = limnpy.DataSource(indic_limn_id, indic_limn_title, indic_df)
-    # print indic_pt
-    indic_ds.write(basedir)
-    indic_ds.write_graph(indic_langs, basedir=basedir)
+limnsync.write_datasources(jobs, basedir, processes, incremental)
@@ -0,0 +1,125 @@
+"""
+loads the wikistats csv dumps (StatisticsMonthly.csv, PageViewsPerMonthAll.csv, ...) as a
+long frame of project, date and value columns.  only the requested columns are parsed,
+with fixed dtypes, and the result is cached as <cache_dir>/<file>.npz next to the size and
+mtime of the csv it came from, so that later runs on an unchanged dump skip the parse:
+
+    df_long = wikistats.read_csv(stats_fn, fieldnames, ['project', 'date'] + val_keys)
+
+StatisticsUserActivitySpread.csv is too wide to go through that, so read_activity_spread
+streams it in chunks instead, see below.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import atomic
+
+# wikistats writes dates as 01/31/2013
+DATE_FORMAT = '%m/%d/%Y'
+
+CACHE_VERSION = 1
+
+
+def parse_dates(values):
+    """parses each distinct date string once, as the dumps repeat every date for each
+    project"""
+    codes, uniques = pd.factorize(values)
+    try:
+        dates = pd.to_datetime(uniques, format=DATE_FORMAT)
+    except ValueError:
+        dates = pd.to_datetime(uniques)
+    return np.asarray(dates, dtype='datetime64[ns]')[codes]
+
+def parse_csv(path, fieldnames, columns):
+    """reads the given columns of the headerless csv whose columns are fieldnames.  project
+    stays a string, date is parsed and everything else is read as float64"""
+    usecols = [fieldnames.index(column) for column in columns]
+    dtypes = dict((i, str if column in ('project', 'date') else np.float64) for i, column in zip(usecols, columns))
+    df = pd.read_csv(path, sep=',', header=None, usecols=usecols, dtype=dtypes)
+    df.columns = [fieldnames[i] for i in df.columns]
+    if 'date' in df:
+        df['date'] = parse_dates(df['date'].values)
+    return df[columns]
+
+def source_key(path):
+    st = os.stat(path)
+    return np.array([CACHE_VERSION, st.st_size, int(st.st_mtime * 1e6)], dtype=np.int64)
+
+def cache_path(path, cache_dir):
+    return os.path.join(cache_dir, '%s.npz' % os.path.basename(path))
+
+def load_cache(path, columns, cache_dir):
+    """returns the cached frame, or None if there is none for the current version of path"""
+    cached = cache_path(path, cache_dir)
+    if not os.path.exists(cached):
+        return None
+    data = np.load(cached)
+    if not (data['key'] == source_key(path)).all() or list(data['columns']) != list(columns):
+        return None
+    df = pd.DataFrame(dict((column, data['col_%d' % i]) for i, column in enumerate(columns)), columns=columns)
+    if 'date' in df:
+        df['date'] = df['date'].values.astype('datetime64[ns]')
+    return df
+
+def save_cache(df, path, cache_dir):
+    """saves each column of df as a plain array"""
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    arrays = {'key' : source_key(path), 'columns' : np.array(list(df.columns))}
+    for i, column in enumerate(df.columns):
+        values = np.asarray(df[column].values)
+        if column == 'date':
+            values = values.astype('datetime64[ns]').view(np.int64)
+        elif values.dtype.kind not in 'biuf':
+            # plain fixed width strings, so that the file loads without pickle
+            values = values.astype(str)
+        arrays['col_%d' % i] = values
+    atomic.save(cache_path(path, cache_dir), lambda tmp_path : np.savez(tmp_path, **arrays))
+
+def read_csv(path, fieldnames, columns, cache_dir='cache'):
+    df = load_cache(path, columns, cache_dir)
+    if df is None:
+        df = parse_csv(path, fieldnames, columns)
+        save_cache(df, path, cache_dir)
+    return df
+
+
+# StatisticsUserActivitySpread.csv has a project and a date followed by, for each of these
+# namespace groups and user kinds in turn, the number of users with at least each number of
+# edits that month
+ACTIVITY_SPREAD = [('articles', 'users', [1, 3, 5, 10, 25, 100, 250, 1000, 2500, 10000, 25000]),
+                   ('articles', 'bots', [5, 10, 100, 1000, 10000, 100000]),
+                   ('talk', 'users', [1, 3, 5, 10, 25, 100, 250, 1000, 2500, 10000, 25000, 100000]),
+                   ('talk', 'bots', [5, 10, 100, 1000, 10000, 100000]),
+                   ('other', 'users', [1, 3, 5, 10, 25, 100, 250, 1000, 2500, 10000, 25000]),
+                   ('other', 'bots', [5, 10, 100, 1000, 10000, 100000])]
+
+ACTIVITY_COLUMNS = ['%s_%s_%d' % (namespace, kind, threshold)
+                    for namespace, kind, thresholds in ACTIVITY_SPREAD for threshold in thresholds]
+
+def iter_activity_spread(path, projects=None, chunksize=100000):
+    """yields the rows of an activity spread csv as long frames of project, date and a
+    float32 column per ACTIVITY_COLUMNS, chunksize lines at a time.  with projects, only
+    the rows of those projects are kept, so memory is bounded by the chunk and the
+    projects asked for rather than by the file"""
+    n_columns = 2 + len(ACTIVITY_COLUMNS)
+    dtypes = dict((i, np.float32) for i in range(2, n_columns))
+    dtypes.update({0 : str, 1 : str})
+    chunks = pd.read_csv(path, sep=',', header=None, usecols=range(n_columns), names=range(n_columns),
+                         dtype=dtypes, chunksize=chunksize)
+    for chunk in chunks:
+        if projects is not None:
+            chunk = chunk[chunk[0].isin(projects)]
+        if not len(chunk):
+            continue
+        chunk.columns = ['project', 'date'] + ACTIVITY_COLUMNS
+        chunk['date'] = parse_dates(chunk['date'].values)
+        yield chunk
+
+def read_activity_spread(path, projects=None, chunksize=100000):
+    chunks = list(iter_activity_spread(path, projects, chunksize))
+    if not chunks:
+        return pd.DataFrame(columns=['project', 'date'] + ACTIVITY_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
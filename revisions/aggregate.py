@@ -0,0 +1,199 @@
+"""
+bounded memory version of the filter / tag / size / count stages in process.py.  revision
+chunks are pushed through RevisionAggregator one at a time.  it only keeps the current
+size of every page (a dense array indexed by page_id) and the per cohort, per day totals,
+so peak memory is proportional to pages + days rather than to revisions.
+
+for the bytes graphs to come out the same as the in-memory path, chunks have to arrive in
+the order in which get_size would see the revisions.  the revision caches are in rev_id
+order, which is also the in-memory order unless rev_timestamp decreases with rev_id
+somewhere (e.g. imported revisions).  such revisions are counted in out_of_order.
+
+the aggregator state can be saved to a checkpoint directory and restored on the next run,
+which then only has to push the revisions added to the cache since.  the checkpoint
+freezes the namespace and bot status of already processed revisions as of the run that
+processed them.
+"""
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import mwtime
+
+COHORTS = np.array(['Other', 'bot'], dtype=object)
+
+
+def size_frames(totals):
+    """turns a frame of per cohort, per day byte deltas (columns cohort, date as YYYYMMDD
+    int, delta) into the dict of per cohort size frames returned by get_size"""
+    dfs = {}
+    for cohort, df in totals.groupby('cohort'):
+        df = df[['date', 'delta']].reset_index(drop=True)
+        df['date'] = mwtime.decode_ymd(df['date'].values).astype('datetime64[ns]')
+        df['size'] = df['delta'].cumsum()
+        dfs[cohort] = df
+        print 'cohort: %s, df:\n%s' % (cohort,df)
+    return dfs
+
+def pivot_counts(counts):
+    """turns a series of revision counts indexed by (cohort, YYYYMMDD int) into the daily
+    date x cohort frame built by make_rev_graphs"""
+    counts = counts.reset_index()
+    counts.columns = ['cohort', 'rev_timestamp', 'revisions']
+    counts['rev_timestamp'] = mwtime.decode_ymd(counts['rev_timestamp'].values).astype('datetime64[ns]')
+    counts = counts.pivot(index='rev_timestamp', columns='cohort', values='revisions')
+    counts['total'] = counts.sum(axis=1)
+    return counts
+
+def accumulate(total, part):
+    if total is None:
+        return part
+    return total.add(part, fill_value=0)
+
+
+class RevisionAggregator(object):
+    """namespace filters, bot tags and aggregates revision chunks.  page (a page_id,
+    page_namespace frame) and namespaces are only needed when the chunks have not been
+    filtered on the server, and bots (a ug_user frame) only when the chunks carry no
+    rev_bot column"""
+
+    def __init__(self, namespaces=None, page=None, bots=None):
+        self.page_ns = None
+        if page is not None:
+            page_ids = page['page_id'].values.astype(np.int64)
+            self.page_ns = np.empty(page_ids.max() + 1 if len(page_ids) else 0, dtype=np.int16)
+            self.page_ns.fill(-1)
+            self.page_ns[page_ids] = page['page_namespace'].values
+            self.namespaces = np.asarray(namespaces)
+        self.bots = None
+        if bots is not None:
+            self.bots = np.unique(bots['ug_user'].values)
+
+        self.sizes = np.zeros(0, dtype=np.int64)
+        self.last_ts = np.zeros(0, dtype=np.int64)
+        self.deltas = None
+        self.counts = None
+        self.rows_in = 0
+        self.rows_out = 0
+        self.out_of_order = 0
+
+    def grow(self, max_page):
+        if max_page < len(self.sizes):
+            return
+        extra = max(max_page + 1, 2 * len(self.sizes)) - len(self.sizes)
+        self.sizes = np.concatenate([self.sizes, np.zeros(extra, dtype=np.int64)])
+        self.last_ts = np.concatenate([self.last_ts, np.zeros(extra, dtype=np.int64)])
+
+    def add(self, chunk):
+        self.rows_in += len(chunk)
+        page = chunk['rev_page'].values.astype(np.int64)
+
+        if self.page_ns is not None:
+            # revisions of pages missing from the page table are dropped, like the inner merge
+            ns = np.empty(len(page), dtype=np.int16)
+            ns.fill(-1)
+            known = page < len(self.page_ns)
+            ns[known] = self.page_ns[page[known]]
+            keep = np.in1d(ns, self.namespaces)
+            chunk = chunk[keep]
+            page = page[keep]
+        if not len(chunk):
+            return
+        self.rows_out += len(chunk)
+
+        if 'rev_bot' in chunk:
+            is_bot = chunk['rev_bot'].values > 0
+        elif self.bots is not None:
+            is_bot = np.in1d(chunk['rev_user'].values, self.bots)
+        else:
+            is_bot = np.zeros(len(chunk), dtype=bool)
+
+        order = np.argsort(page, kind='mergesort')
+        page = page[order]
+        ts = chunk['rev_timestamp'].values.astype(np.int64)[order]
+        # NULL sizes (NaN in csv caches) count as 0, as in the column cache
+        size = np.nan_to_num(chunk['rev_len'].values[order]).astype(np.int64)
+        self.grow(page[-1])
+
+        first_rev = np.ones(len(page), dtype=bool)
+        first_rev[1:] = page[1:] != page[:-1]
+        last_rev = np.ones(len(page), dtype=bool)
+        last_rev[:-1] = first_rev[1:]
+
+        old_size = np.empty_like(size)
+        old_size[1:] = size[:-1]
+        old_size[first_rev] = self.sizes[page[first_rev]]
+        old_ts = np.empty_like(ts)
+        old_ts[1:] = ts[:-1]
+        old_ts[first_rev] = self.last_ts[page[first_rev]]
+        self.out_of_order += int((ts < old_ts).sum())
+
+        self.sizes[page[last_rev]] = size[last_rev]
+        self.last_ts[page[last_rev]] = ts[last_rev]
+
+        frame = pd.DataFrame({'cohort' : COHORTS[is_bot[order].astype(np.int8)],
+                              'date' : mwtime.day_ints(ts),
+                              'delta' : size - old_size})
+        grouped = frame.groupby(['cohort', 'date'])['delta']
+        self.deltas = accumulate(self.deltas, grouped.sum())
+        self.counts = accumulate(self.counts, grouped.size())
+
+    def save(self, path, meta):
+        """writes the per page sizes (as uint32, indexed by page_id), last timestamps and
+        daily totals to the directory path, along with meta.  the new checkpoint is written
+        next to the old one and swapped in with renames"""
+        tmp_path = '%s.tmp' % path
+        old_path = '%s.old' % path
+        for p in [tmp_path, old_path]:
+            if os.path.isdir(p):
+                shutil.rmtree(p)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'sizes.npy'), self.sizes.astype(np.uint32))
+        np.save(os.path.join(tmp_path, 'last_ts.npy'), self.last_ts)
+        totals = pd.DataFrame({'delta' : self.deltas.astype(np.int64),
+                               'revisions' : self.counts.astype(np.int64)})
+        totals.index.names = ['cohort', 'date']
+        totals.reset_index().to_csv(os.path.join(tmp_path, 'totals.csv'), index=False)
+        json.dump(meta, open(os.path.join(tmp_path, 'meta.json'), 'w'))
+
+        if os.path.isdir(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+
+    def restore(self, path, meta):
+        """loads the checkpoint in path if it was saved with the same meta (ignoring its
+        rows entry) and returns the number of revision cache rows it covers, or 0 if
+        there is no usable checkpoint"""
+        meta_name = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_name):
+            return 0
+        saved = json.load(open(meta_name))
+        rows = saved.pop('rows')
+        if saved != dict((k, v) for k, v in meta.items() if k != 'rows'):
+            print 'ignoring checkpoint %s saved with different settings: %s' % (path, saved)
+            return 0
+
+        self.sizes = np.load(os.path.join(path, 'sizes.npy')).astype(np.int64)
+        self.last_ts = np.load(os.path.join(path, 'last_ts.npy'))
+        totals = pd.read_csv(os.path.join(path, 'totals.csv')).set_index(['cohort', 'date'])
+        if len(totals):
+            self.deltas = totals['delta']
+            self.counts = totals['revisions']
+        print 'restored checkpoint %s covering %d revisions' % (path, rows)
+        return rows
+
+    def size_totals(self):
+        """per cohort, per day byte deltas, ready for size_frames"""
+        totals = self.deltas.astype(np.int64)
+        totals.name = 'delta'
+        return totals.reset_index()
+
+    def count_totals(self):
+        """per cohort, per day revision counts, ready for pivot_counts"""
+        return self.counts.astype(np.int64)
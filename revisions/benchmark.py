@@ -0,0 +1,190 @@
+"""
+benchmarks the in-memory stages of process.py on seeded synthetic data, so that their
+scaling can be measured without access to the replicas.  the generator mimics the skew
+of a real wiki: page edit counts and user activity are Zipfian, a fixed fraction of the
+revisions is made by bot accounts, and pages are spread over a mix of namespaces.
+
+every stage reports wall time, rows in/out, rows/sec and peak RSS as one JSON object
+per line, tagged with the git commit, so that runs on different commits can be diffed:
+
+    python benchmark.py --tiers 1M 10M --outfile bench.jsonl
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+import process
+import aggregate
+import mwtime
+import instrument
+
+TIERS = {'1M' : 10**6,
+         '10M' : 10**7,
+         '100M' : 10**8}
+
+# rough share of revisions per namespace on a large wikipedia
+NS_MIX = [(0, 0.55), (1, 0.1), (2, 0.1), (3, 0.15), (4, 0.05), (10, 0.025), (14, 0.025)]
+
+START = np.datetime64('2001-01-15T00:00:00')
+END = np.datetime64('2013-01-01T00:00:00')
+
+
+def zipf_choice(rng, n_items, size, s):
+    """draws size indices from range(n_items) with P(i) proportional to 1 / (i+1)**s"""
+    weights = 1.0 / np.arange(1, n_items + 1) ** s
+    return np.searchsorted(np.cumsum(weights), rng.uniform(0, weights.sum(), size))
+
+def to_mw_timestamps(seconds):
+    """seconds since START -> YYYYMMDDHHMMSS int64s"""
+    dt = START + seconds.astype('timedelta64[s]')
+    days = dt.astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    year = months.astype(np.int64) // 12 + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months).astype(np.int64) + 1
+    secs = (dt - days).astype(np.int64)
+    hms = (secs // 3600) * 10000 + (secs // 60 % 60) * 100 + secs % 60
+    return ((year * 100 + month) * 100 + day) * 1000000 + hms
+
+def synthesize(n_revs, seed=0, pages_per_rev=0.05, users_per_rev=0.02, bot_fraction=0.15, zipf_s=1.1):
+    """returns (rev, page, bots) frames shaped like the output of get_rev, get_page and
+    get_bots for a wiki with n_revs revisions"""
+    rng = np.random.RandomState(seed)
+    n_pages = max(int(n_revs * pages_per_rev), 1)
+    n_users = max(int(n_revs * users_per_rev), 10)
+    n_bots = max(n_users // 1000, 1)
+
+    page_ids = (rng.permutation(n_pages) + 1).astype(np.uint32)
+    ns_values, ns_probs = zip(*NS_MIX)
+    page = pd.DataFrame({'page_id' : page_ids,
+                         'page_namespace' : rng.choice(ns_values, n_pages, p=np.array(ns_probs) / sum(ns_probs)).astype(np.int16)},
+                        columns=['page_id', 'page_namespace'])
+
+    user_ids = (rng.permutation(n_users) + 1).astype(np.uint32)
+    bot_ids = user_ids[:n_bots]
+    human_ids = user_ids[n_bots:]
+    rev_user = human_ids[zipf_choice(rng, len(human_ids), n_revs, zipf_s)]
+    by_bot = rng.uniform(size=n_revs) < bot_fraction
+    rev_user[by_bot] = bot_ids[rng.randint(0, n_bots, by_bot.sum())]
+    bots = pd.DataFrame({'ug_user' : bot_ids})
+
+    span = (END - START).astype(np.int64)
+    seconds = np.sort(rng.randint(0, span, n_revs))
+    rev = pd.DataFrame({'rev_len' : rng.lognormal(8, 1.5, n_revs).clip(0, 2**31).astype(np.uint32),
+                        'rev_timestamp' : to_mw_timestamps(seconds),
+                        'rev_page' : page_ids[zipf_choice(rng, n_pages, n_revs, zipf_s)],
+                        'rev_user' : rev_user},
+                       columns=['rev_len', 'rev_timestamp', 'rev_page', 'rev_user'])
+    rev['rev_day'] = mwtime.day_ints(rev['rev_timestamp'].values)
+    rev['cohort'] = 'Other'
+    return rev, page, bots
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_stage(name, rows_in, func, *args):
+    with instrument.stage(name, rows_in) as rec:
+        result = func(*args)
+    return result, rec
+
+def stream(rev, page, bots, chunksize):
+    agg = aggregate.RevisionAggregator([0], page, bots)
+    for start in xrange(0, len(rev), chunksize):
+        agg.add(rev.iloc[start:start + chunksize])
+    return agg
+
+def bench_tier(tier, opts):
+    n_revs = TIERS[tier]
+    records = []
+
+    (rev, page, bots), rec = run_stage('synthesize', n_revs, synthesize, n_revs, opts['seed'])
+    rec['rows_out'] = len(rev)
+    records.append(rec)
+
+    raw = rev[['rev_len', 'rev_timestamp', 'rev_page', 'rev_user']]
+    agg, rec = run_stage('streaming', len(raw), stream, raw, page, bots, opts['chunksize'])
+    rec['rows_out'] = agg.rows_out
+    records.append(rec)
+    del raw, agg
+
+    filtered, rec = run_stage('filter_revs_ns', len(rev), process.filter_revs_ns, rev, page, [0])
+    rec['rows_out'] = len(filtered)
+    records.append(rec)
+    rev = filtered
+    del filtered
+
+    rev, rec = run_stage('tag_bots', len(rev), process.tag_bots, rev, bots)
+    rec['rows_out'] = len(rev)
+    records.append(rec)
+
+    get_size = process.size_engines[opts['size_engine']]
+    dfs, rec = run_stage('get_size', len(rev), get_size, rev)
+    size_rows = sum(len(df) for df in dfs.values())
+    rec['rows_out'] = size_rows
+    records.append(rec)
+
+    basedir = tempfile.mkdtemp(prefix='revisions_bench')
+    cwd = os.getcwd()
+    # make_bytes_graphs also drops csvs into the working directory
+    os.chdir(basedir)
+    try:
+        result, rec = run_stage('make_rev_graphs', len(rev), process.make_rev_graphs, rev, 'bench', basedir)
+        rec['rows_out'] = None
+        records.append(rec)
+
+        result, rec = run_stage('make_bytes_graphs', size_rows, process.make_bytes_graphs, dfs, 'bench', basedir)
+        rec['rows_out'] = None
+        records.append(rec)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(basedir)
+
+    for rec in records:
+        rec.update({'tier' : tier,
+                    'n_revs' : n_revs,
+                    'seed' : opts['seed'],
+                    'size_engine' : opts['size_engine'],
+                    'commit' : opts['commit'],
+                    'python' : platform.python_version(),
+                    'numpy' : np.__version__,
+                    'pandas' : pd.__version__})
+    return records
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='benchmark the revisions pipeline on synthetic data')
+    parser.add_argument('--tiers', nargs='+', choices=sorted(TIERS.keys()), default=['1M'],
+                        help='number of synthetic revisions to run on')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic data')
+    parser.add_argument('--size_engine', choices=process.size_engines.keys(), default='vectorized',
+                        help='get_size implementation to benchmark')
+    parser.add_argument('--chunksize', type=int, default=1000000,
+                        help='number of revisions per chunk for the streaming stage')
+    parser.add_argument('-o', '--outfile', help='file to append JSON lines to, defaults to stdout')
+    return vars(parser.parse_args())
+
+def main():
+    opts = parse_args()
+    opts['commit'] = git_commit()
+    out = open(opts['outfile'], 'a') if opts['outfile'] else sys.stdout
+    for tier in opts['tiers']:
+        for rec in bench_tier(tier, opts):
+            out.write(json.dumps(rec, sort_keys=True) + '\n')
+            out.flush()
+            print >>sys.stderr, '%-5s %-18s %8.2fs %14.0f rows/s %8.0f MB' % (
+                tier, rec['stage'], rec['seconds'], rec['rows_per_sec'] or 0, rec['peak_rss_bytes'] / 2.0**20)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+cache backends for the revision, page and bot tables pulled by process.py.  both
+backends share the same small interface (exists / open / append / commit / close /
+load) so that the fetch loops don't need to know which one they are writing to.
+
+CsvCache is the original text format.  ColumnCache stores every column as a raw
+fixed-dtype binary file which is memory mapped on load, so there is nothing to parse.
+"""
+import os
+import csv
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+
+REV_COLUMNS = [('rev_len', np.uint32),
+               ('rev_timestamp', np.int64),
+               ('rev_page', np.uint32),
+               ('rev_user', np.uint32)]
+
+REV_BOT_COLUMNS = REV_COLUMNS + [('rev_bot', np.uint8)]
+
+PAGE_COLUMNS = [('page_id', np.uint32),
+                ('page_namespace', np.int16)]
+
+BOT_COLUMNS = [('ug_user', np.uint32)]
+
+FORMATS = ['csv', 'columns']
+
+
+def read_manifest(cache):
+    """returns the manifest describing what has been committed to cache, or None
+    if the cache has no manifest"""
+    manifest_name = '%s.manifest.json' % cache.path
+    if not os.path.exists(manifest_name):
+        return None
+    return json.load(open(manifest_name))
+
+def write_manifest(cache, manifest):
+    """writes the manifest to a temporary file and renames it into place so that a crash
+    can never leave a half-written manifest behind"""
+    manifest_name = '%s.manifest.json' % cache.path
+    tmp_name = '%s.tmp' % manifest_name
+    f = open(tmp_name, 'w')
+    json.dump(manifest, f)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.rename(tmp_name, manifest_name)
+
+
+class CsvCache(object):
+    """one csv file per table.  offsets are byte offsets into the file"""
+
+    def __init__(self, name, columns):
+        self.path = '%s.csv' % name
+        self.columns = columns
+        self.outfile = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def open(self, offset=0):
+        """opens the cache for appending, discarding anything written after offset"""
+        mode = 'r+b' if self.exists() else 'wb'
+        self.outfile = open(self.path, mode)
+        self.outfile.truncate(offset)
+        self.outfile.seek(offset)
+        self.outcsv = csv.writer(self.outfile)
+
+    def append(self, rows):
+        self.outcsv.writerows(rows)
+
+    def commit(self):
+        """flushes everything appended so far to disk and returns the offset from which
+        open() should resume"""
+        self.outfile.flush()
+        os.fsync(self.outfile.fileno())
+        return self.outfile.tell()
+
+    def close(self):
+        self.outfile.close()
+        self.outfile = None
+
+    def load(self, nrows=None):
+        return pd.read_csv(self.path,
+                           names=[col for col, dtype in self.columns],
+                           encoding='utf-8',
+                           nrows=nrows)
+
+    def iter_chunks(self, chunksize, start=0):
+        return pd.read_csv(self.path,
+                           names=[col for col, dtype in self.columns],
+                           encoding='utf-8',
+                           skiprows=start,
+                           chunksize=chunksize)
+
+
+class ColumnCache(object):
+    """a directory holding one raw binary file per column, each with the fixed dtype given
+    in columns.  offsets are row counts, which makes appending and truncating a matter of
+    file lengths"""
+
+    def __init__(self, name, columns):
+        self.path = '%s.cols' % name
+        self.columns = columns
+        self.outfiles = None
+        self.rows = 0
+
+    def column_path(self, col):
+        return os.path.join(self.path, '%s.bin' % col)
+
+    def exists(self):
+        return all(os.path.exists(self.column_path(col)) for col, dtype in self.columns)
+
+    def open(self, offset=0):
+        """opens the cache for appending, discarding any rows after row number offset"""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.outfiles = []
+        for col, dtype in self.columns:
+            fname = self.column_path(col)
+            f = open(fname, 'r+b' if os.path.exists(fname) else 'wb')
+            f.truncate(offset * np.dtype(dtype).itemsize)
+            f.seek(0, os.SEEK_END)
+            self.outfiles.append(f)
+        self.rows = offset
+
+    def append(self, rows):
+        """appends a list of row tuples as returned by the cursor"""
+        if not rows:
+            return
+        for i, ((col, dtype), f) in enumerate(zip(self.columns, self.outfiles)):
+            # NULLs (e.g. rev_len on very old revisions) are stored as 0
+            values = np.fromiter((int(row[i] or 0) for row in rows), dtype=dtype, count=len(rows))
+            values.tofile(f)
+        self.rows += len(rows)
+
+    def append_frame(self, df):
+        for (col, dtype), f in zip(self.columns, self.outfiles):
+            df[col].fillna(0).values.astype(dtype).tofile(f)
+        self.rows += len(df)
+
+    def commit(self):
+        for f in self.outfiles:
+            f.flush()
+            os.fsync(f.fileno())
+        return self.rows
+
+    def close(self):
+        for f in self.outfiles:
+            f.close()
+        self.outfiles = None
+
+    def mmap_columns(self):
+        data = {}
+        for col, dtype in self.columns:
+            fname = self.column_path(col)
+            if os.path.getsize(fname) == 0:
+                # np.memmap refuses to map empty files
+                data[col] = np.zeros(0, dtype=dtype)
+            else:
+                data[col] = np.memmap(fname, dtype=dtype, mode='r')
+        return data
+
+    def load(self, nrows=None):
+        data = self.mmap_columns()
+        return pd.DataFrame(dict((col, values[:nrows]) for col, values in data.items()),
+                            columns=[col for col, dtype in self.columns])
+
+    def iter_chunks(self, chunksize, start=0):
+        """yields frames of chunksize rows from row number start on, only ever paging in
+        one chunk of each column"""
+        data = self.mmap_columns()
+        rows = len(data[self.columns[0][0]])
+        for chunk_start in xrange(start, rows, chunksize):
+            yield pd.DataFrame(dict((col, values[chunk_start:chunk_start + chunksize]) for col, values in data.items()),
+                               columns=[col for col, dtype in self.columns])
+
+
+def convert(src, dst):
+    """copies the committed rows of src into dst along with its manifest.  dst is built
+    in a temporary directory and renamed into place, so it only ever exists complete"""
+    manifest = read_manifest(src)
+    nrows = manifest['rows'] if manifest else None
+    print 'converting %s to %s' % (src.path, dst.path)
+    df = src.load(nrows=nrows)
+
+    final_path = dst.path
+    dst.path = '%s.tmp' % final_path
+    if os.path.isdir(dst.path):
+        shutil.rmtree(dst.path)
+    dst.open(0)
+    dst.append_frame(df)
+    offset = dst.commit()
+    dst.close()
+    os.rename(dst.path, final_path)
+    dst.path = final_path
+
+    if manifest:
+        manifest['offset'] = offset
+        write_manifest(dst, manifest)
+
+def open_cache(name, columns, fmt='csv', needs_manifest=False):
+    """returns the cache called name in format fmt.  when a columns cache is asked for but
+    only a csv cache exists, the csv is converted once so that later runs never parse it.
+    with needs_manifest (the revision caches) a csv without a manifest is not converted,
+    as none of its rows can be trusted and they are all fetched again anyway"""
+    if fmt == 'csv':
+        return CsvCache(name, columns)
+    cache = ColumnCache(name, columns)
+    legacy = CsvCache(name, columns)
+    if not cache.exists() and legacy.exists():
+        if needs_manifest and read_manifest(legacy) is None:
+            print 'not converting %s, which has no manifest' % legacy.path
+        else:
+            convert(legacy, cache)
+    return cache
@@ -0,0 +1,141 @@
+"""
+per stage instrumentation for process.py.  each language gets a RunReport which records,
+for every stage, the wall time, rows in/out, rows/sec and peak RSS, plus the latency of
+every database fetch batch.  a process only ever works on one language at a time, so the
+active report lives in a module global and the pipeline just calls stage() and
+fetch_batch():
+
+    with instrument.stage('filter_ns', len(rev)) as rec:
+        rev = filter_revs_ns(rev, page, ns)
+        rec['rows_out'] = len(rev)
+
+one chosen stage can also be run under cProfile (and tracemalloc, where the python
+version has it), with the profile dumped to <lang>.<stage>.prof.
+"""
+import os
+import csv
+import json
+import time
+import cProfile
+import resource
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import numpy as np
+
+
+def reset_peak_rss():
+    """resets the kernel's high water mark of the resident set (linux >= 4.0), so that
+    peak_rss measures a single stage"""
+    try:
+        open('/proc/self/clear_refs', 'w').write('5')
+    except IOError:
+        pass
+
+def peak_rss():
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # ru_maxrss is in kilobytes on linux and never resets
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RunReport(object):
+
+    def __init__(self, lang, profile_stage=None, profile_dir='.'):
+        self.lang = lang
+        self.profile_stage = profile_stage
+        self.profile_dir = profile_dir
+        self.stages = []
+        self.depth = 0
+        self.batches = None
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """times the enclosed block.  the yielded record can be given a rows_out entry.
+        nested stages (e.g. limn writes inside the graph stages) are recorded too, but
+        only top level stages reset the peak RSS"""
+        rec = {'lang' : self.lang,
+               'stage' : name,
+               'depth' : self.depth,
+               'rows_in' : rows_in,
+               'rows_out' : None}
+        outer_batches = self.batches
+        self.batches = []
+        if self.depth == 0:
+            reset_peak_rss()
+        profiler = None
+        if name == self.profile_stage:
+            profiler = cProfile.Profile()
+            if tracemalloc:
+                tracemalloc.start()
+            profiler.enable()
+
+        self.depth += 1
+        start = time.time()
+        try:
+            yield rec
+        finally:
+            rec['seconds'] = time.time() - start
+            self.depth -= 1
+            if profiler:
+                profiler.disable()
+                rec['profile'] = os.path.join(self.profile_dir, '%s.%s.prof' % (self.lang, name))
+                profiler.dump_stats(rec['profile'])
+                if tracemalloc:
+                    rec['tracemalloc_top'] = [str(stat) for stat in
+                                              tracemalloc.take_snapshot().statistics('lineno')[:20]]
+                    tracemalloc.stop()
+            rows = rec['rows_out'] if rec['rows_in'] is None else rec['rows_in']
+            rec['rows_per_sec'] = rows / rec['seconds'] if rows is not None and rec['seconds'] else None
+            rec['peak_rss_bytes'] = peak_rss()
+            if self.batches:
+                latencies = np.array(self.batches)
+                rec['fetch_batches'] = len(latencies)
+                rec['fetch_latency_mean'] = latencies.mean()
+                rec['fetch_latency_p50'] = np.percentile(latencies, 50)
+                rec['fetch_latency_p95'] = np.percentile(latencies, 95)
+                rec['fetch_latency_max'] = latencies.max()
+            self.batches = outer_batches
+            self.stages.append(rec)
+
+    def fetch_batch(self, seconds):
+        if self.batches is not None:
+            self.batches.append(seconds)
+
+
+# stands in outside of process_lang, e.g. when the stages are called from benchmark.py
+current = RunReport(None)
+
+def start(lang, profile_stage=None, profile_dir='.'):
+    global current
+    current = RunReport(lang, profile_stage, profile_dir)
+    return current
+
+def stage(name, rows_in=None):
+    return current.stage(name, rows_in)
+
+def fetch_batch(seconds):
+    current.fetch_batch(seconds)
+
+
+REPORT_COLUMNS = ['lang', 'stage', 'depth', 'seconds', 'rows_in', 'rows_out', 'rows_per_sec', 'peak_rss_bytes',
+                  'fetch_batches', 'fetch_latency_mean', 'fetch_latency_p50', 'fetch_latency_p95', 'fetch_latency_max']
+
+def write_report(stages, path):
+    """writes the stage records of a run as csv if path ends in .csv, else as json"""
+    if path.endswith('.csv'):
+        f = open(path, 'wb')
+        writer = csv.DictWriter(f, REPORT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(stages)
+        f.close()
+    else:
+        json.dump(stages, open(path, 'w'), indent=2, sort_keys=True)
@@ -0,0 +1,42 @@
+"""
+vectorized decoding of MediaWiki timestamps, which the caches hold as YYYYMMDDHHMMSS
+int64s.  everything is integer arithmetic on whole arrays, so there is no per-row
+string formatting or strptime.  day bins are grouped on as YYYYMMDD ints and only the
+(few) distinct bins are turned into datetime64 values.
+"""
+import numpy as np
+
+
+def day_ints(ts):
+    """YYYYMMDDHHMMSS -> YYYYMMDD"""
+    return np.asarray(ts).astype(np.int64) // 1000000
+
+def month_ints(ts):
+    """YYYYMMDDHHMMSS -> YYYYMM"""
+    return np.asarray(ts).astype(np.int64) // 100000000
+
+def decode_ymd(ymd):
+    """YYYYMMDD ints -> datetime64[D]"""
+    ymd = np.asarray(ymd).astype(np.int64)
+    months = (ymd // 10000 - 1970) * 12 + (ymd // 100) % 100 - 1
+    return months.astype('datetime64[M]') + (ymd % 100 - 1).astype('timedelta64[D]')
+
+def decode_ym(ym):
+    """YYYYMM ints -> datetime64[M]"""
+    ym = np.asarray(ym).astype(np.int64)
+    return ((ym // 100 - 1970) * 12 + ym % 100 - 1).astype('datetime64[M]')
+
+def decode_days(ts):
+    """YYYYMMDDHHMMSS -> datetime64[D] day bins"""
+    return decode_ymd(day_ints(ts))
+
+def decode_months(ts):
+    """YYYYMMDDHHMMSS -> datetime64[M] month bins"""
+    return decode_ym(month_ints(ts))
+
+def rev_days(revs):
+    """the YYYYMMDD day of every revision in revs, using the rev_day column which get_rev
+    derives once at load time when it is there"""
+    if 'rev_day' in revs:
+        return revs['rev_day'].values
+    return day_ints(revs['rev_timestamp'].values)
@@ -1,136 +1,161 @@
-import copy
 import argparse
 from operator import itemgetter
-import MySQLdb
+from itertools import izip
 from MySQLdb.cursors import SSCursor
-import os, codecs, csv
-from collections import defaultdict
+import os, sys, time
+import traceback
+from collections import defaultdict, namedtuple
 import datetime
+import numpy as np
 import pandas as pd
 
 import gcat
 import limnpy
 
-cluster_mapping = {'enwiki':'s1',
-                'bgwiki':'s2',
-                'bgwiktionary':'s2',
-                'cswiki':'s2',
-                'enwikiquote':'s2',
-                'enwiktionary':'s2',
-                'eowiki':'s2',
-                'fiwiki':'s2',
-                'idwiki':'s2',
-                'itwiki':'s2',
-                'nlwiki':'s2',
-                'nowiki':'s2',
-                'plwiki':'s2',
-                'ptwiki':'s2',
-                'svwiki':'s2',
-                'thwiki':'s2',
-                'trwiki':'s2',
-                'zhwiki':'s2',
-                'commonswiki':'s4',
-                'dewiki':'s5',
-                'frwiki':'s6',
-                'jawiki':'s6',
-                'ruwiki':'s6',
-                'eswiki':'s7',
-                'huwiki':'s7',
-                'hewiki':'s7',
-                'ukwiki':'s7',
-                'frwiktionary':'s7',
-                'metawiki':'s7',
-                'arwiki':'s7',
-                'centralauth':'s7',
-                'cawiki':'s7',
-                'viwiki':'s7',
-                'fawiki':'s7',
-                'rowiki':'s7',
-                'kowiki':'s7'
-              }
-
-def get_cur(lang):
-    db = '%swiki' % lang
-    cluster = cluster_mapping.get(db, 's3')
-    host_name = '%s-analytics-slave.eqiad.wmnet' % cluster
-    conn = MySQLdb.connect(host=host_name,
-                           read_default_file=os.path.expanduser('~/.my.cnf'),
-                           cursorclass=SSCursor,
-                           db=db,
-                           charset='utf8',
-                           use_unicode=True)
-    return conn.cursor() 
-
-def get_rev(lang, start_date, cur):
-    cache_name = '%s.revision.cache.csv' % lang
-
-    if not os.path.exists(cache_name):
-        batch_size = 100000
-        query = """SELECT rev_len, rev_timestamp, rev_page, rev_user FROM revision WHERE rev_timestamp > %s"""
-        print query % (start_date.strftime('%Y%m%d'),) 
-        cur.execute(query, (start_date.strftime('%Y%m%d'),))
-        outfile = codecs.open(cache_name, encoding='utf-8', mode='w')
-        outcsv = csv.writer(outfile)
-        so_far = 0
-        while True:
-            print 'processed %d lines' % so_far
-            res = cur.fetchmany(batch_size)
-            if not res:
-                break
-            outcsv.writerows(res)
-            so_far += batch_size
-        outfile.close()
-        
-    print 'loading revision cache from: %s' % cache_name
-    df = pd.read_csv(cache_name, 
-                       names=['rev_len', 'rev_timestamp', 'rev_page', 'rev_user'], 
-                       encoding='utf-8')
-    df = df.sort('rev_timestamp', inplace=True)
-    df['cohort'] = 'Other'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dbpool
+from dbpool import cluster_mapping, get_cluster
+import caches
+import aggregate
+import mwtime
+import instrument
+
+# connections are reused across languages on the same cluster
+pool = dbpool.ConnectionPool(cursorclass=SSCursor)
+
+def rev_query(namespaces=None, bot_flag=False):
+    """builds the revision extraction query.  when namespaces is given the page join and
+    namespace restriction happen on the server, and bot_flag adds a trailing column which
+    is 1 for revisions made by a member of the bot group"""
+    columns = ['rev_id', 'rev_len', 'rev_timestamp', 'rev_page', 'rev_user']
+    joins = []
+    conditions = ['rev_id > %s', 'rev_timestamp > %s']
+    if namespaces:
+        joins.append('INNER JOIN page ON page_id = rev_page')
+        conditions.append('page_namespace IN (%s)' % ', '.join(['%s'] * len(namespaces)))
+    if bot_flag:
+        columns.append('ug_user IS NOT NULL')
+        joins.append("LEFT JOIN user_groups ON ug_user = rev_user AND ug_group = 'bot'")
+    return """SELECT %s FROM revision %s
+               WHERE %s ORDER BY rev_id""" % (', '.join(columns), ' '.join(joins), ' AND '.join(conditions))
+
+def fetch_revs(cur, cache, manifest, start_date, batch_size, namespaces=None, bot_flag=False):
+    """appends every revision with rev_id above the manifest's high-water mark to the
+    cache.  each batch is flushed to disk before the manifest is advanced, so anything
+    past manifest['offset'] is an uncommitted partial batch and is truncated away"""
+    cache.open(manifest['offset'])
+
+    query = rev_query(namespaces, bot_flag)
+    params = (manifest['max_rev_id'], start_date.strftime('%Y%m%d')) + tuple(namespaces or [])
+    print query % params
+    cur.execute(query, params)
+    manifest['complete'] = False
+    manifest['fetched'] = 0
+    while True:
+        start = time.time()
+        res = cur.fetchmany(batch_size)
+        instrument.fetch_batch(time.time() - start)
+        if not res:
+            break
+        cache.append([row[1:] for row in res])
+
+        manifest['max_rev_id'] = res[-1][0]
+        manifest['max_rev_timestamp'] = max([manifest['max_rev_timestamp']] + [row[2] for row in res])
+        manifest['offset'] = cache.commit()
+        manifest['rows'] += len(res)
+        manifest['fetched'] += len(res)
+        caches.write_manifest(cache, manifest)
+        print 'processed %d lines' % manifest['rows']
+    cache.close()
+
+    manifest['complete'] = True
+    manifest['updated'] = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    caches.write_manifest(cache, manifest)
+    return manifest
+
+def fetch_table(cur, cache, query, batch_size):
+    """writes the full result of query to cache"""
+    print query 
+    cur.execute(query)
+    cache.open()
+    so_far = 0
+    while True:
+        start = time.time()
+        res = cur.fetchmany(batch_size)
+        instrument.fetch_batch(time.time() - start)
+        if not res:
+            break
+        cache.append(res)
+        so_far += len(res)
+        print 'processed %d lines' % so_far
+    cache.commit()
+    cache.close()
+
+def update_rev_cache(lang, start_date, cur, fmt='csv', batch_size=100000, namespaces=None, bot_flag=False):
+    """brings the revision cache for lang up to date and returns it.  the cache's manifest
+    records the high-water mark (max rev_id and rev_timestamp) of the last committed batch,
+    so a stale cache only fetches the revisions made since, and an interrupted download
+    resumes from its last committed batch instead of starting over.
+
+    namespaces and bot_flag select server-side filtering (see rev_query), which is cached
+    separately from the full revision table.  note that the bot flag of a cached revision
+    reflects group membership at the time it was fetched"""
+    name = '%s.revision' % lang
+    columns = caches.REV_COLUMNS
+    if namespaces:
+        name += '.ns%s' % '_'.join(map(str, sorted(namespaces)))
+    if bot_flag:
+        name += '.botflag'
+        columns = caches.REV_BOT_COLUMNS
+    cache = caches.open_cache('%s.cache' % name, columns, fmt, needs_manifest=True)
+
+    manifest = caches.read_manifest(cache)
+    if manifest is None or not cache.exists():
+        # without a manifest there is no telling how much of the cache is valid
+        print 'no manifest found for %s, fetching all revisions' % cache.path
+        manifest = {'max_rev_id' : 0,
+                    'max_rev_timestamp' : '',
+                    'offset' : 0,
+                    'rows' : 0,
+                    'complete' : False,
+                    'created' : datetime.datetime.now().strftime('%Y%m%d%H%M%S')}
+    elif not manifest['complete']:
+        print 'resuming %s from rev_id %d' % (cache.path, manifest['max_rev_id'])
+    fetch_revs(cur, cache, manifest, start_date, batch_size, namespaces, bot_flag)
+    return cache
+
+def get_rev(lang, start_date, cur, fmt='csv', batch_size=100000, namespaces=None, bot_flag=False):
+    """loads the revision cache for lang after updating it with update_rev_cache"""
+    cache = update_rev_cache(lang, start_date, cur, fmt, batch_size, namespaces, bot_flag)
+    return load_rev(cache, bot_flag)
+
+def load_rev(cache, bot_flag=False):
+    print 'loading revision cache from: %s' % cache.path
+    df = cache.load()
+    # a stable sort keeps revisions with equal timestamps in rev_id order
+    df.sort('rev_timestamp', inplace=True, kind='mergesort')
+    df['rev_day'] = mwtime.day_ints(df['rev_timestamp'].values)
+    if bot_flag:
+        df['cohort'] = np.where(df.pop('rev_bot') > 0, 'bot', 'Other')
+    else:
+        df['cohort'] = 'Other'
     return df
 
-def get_page(lang, cur):
-    cache_name = '%s.page.cache.csv' % lang
-
-    if not os.path.exists(cache_name):
-        batch_size = 10000
-        query = """SELECT page_id, page_namespace FROM page"""
-        print query 
-        cur.execute(query)
-        outfile = codecs.open(cache_name, encoding='utf-8', mode='w')
-        outcsv = csv.writer(outfile)
-        while True:
-            print 'processed %d lines' % batch_size
-            res = cur.fetchmany(batch_size)
-            if not res:
-                break
-            outcsv.writerows(res)
-        outfile.close()
+def get_page(lang, cur, fmt='csv'):
+    cache = caches.open_cache('%s.page.cache' % lang, caches.PAGE_COLUMNS, fmt)
+    if not cache.exists():
+        fetch_table(cur, cache, """SELECT page_id, page_namespace FROM page""", 10000)
         
-    print 'loading page cache from: %s' % cache_name
-    df = pd.read_csv(cache_name, names=['page_id', 'page_namespace'], encoding='utf-8')
-    return df
+    print 'loading page cache from: %s' % cache.path
+    return cache.load()
 
-def get_bots(lang, cur):
-    cache_name = '%s.bots.cache.csv' % lang
-    if not os.path.exists(cache_name):
-        batch_size = 10000
-        query = """SELECT ug_user FROM user_groups WHERE ug_group = 'bot'"""
-        print query 
-        cur.execute(query)
-        outfile = codecs.open(cache_name, encoding='utf-8', mode='w')
-        outcsv = csv.writer(outfile)
-        while True:
-            print 'processed %d lines' % batch_size
-            res = cur.fetchmany(batch_size)
-            if not res:
-                break
-            outcsv.writerows(res)
-        outfile.close()
+def get_bots(lang, cur, fmt='csv'):
+    cache = caches.open_cache('%s.bots.cache' % lang, caches.BOT_COLUMNS, fmt)
+    if not cache.exists():
+        fetch_table(cur, cache, """SELECT ug_user FROM user_groups WHERE ug_group = 'bot'""", 10000)
         
-    print 'loading page cache from: %s' % cache_name
-    df = pd.read_csv(cache_name, names=['ug_user'], encoding='utf-8')
-    return df
+    print 'loading bot cache from: %s' % cache.path
+    return cache.load()
 
 
 
@@ -147,7 +172,7 @@ def tag_bots(rev, bots):
     rev['cohort'][rev['rev_user'].isin(bots['ug_user'])] = 'bot'
     return rev
 
-def get_size(revs):
+def get_size_loop(revs):
     """computes the size of the wikipedia at each point in time.  has time complexity O(r) and
     space complexity O(r+t) (number of revisions and number of time bins).  Iterating over the 
     revisions in order it keeps an up to date hash of the current size of each article.  It 
@@ -161,7 +186,11 @@ def get_size(revs):
     sizes = defaultdict(int)
     deltas = defaultdict(lambda : defaultdict(int))
 
-    for size, ts, page_id, user_id, cohort in revs.itertuples(index=False):
+    # uint32 sizes from the column cache would wrap around on subtraction
+    rev_len = revs['rev_len'].values
+    rev_len = rev_len.astype(np.promote_types(rev_len.dtype, np.int64))
+    rows = izip(rev_len, *[revs[column].values for column in ['rev_timestamp', 'rev_page', 'rev_user', 'cohort']])
+    for size, ts, page_id, user_id, cohort in rows:
         old_size = sizes[page_id]
         delta = size - old_size # should be added to totals
         sizes[page_id] = size
@@ -179,12 +208,42 @@ def get_size(revs):
         print 'cohort: %s, df:\n%s' % (cohort,df)
     return dfs
 
+def get_size(revs):
+    """vectorized equivalent of get_size_loop, with identical output.  a stable sort on page
+    keeps each page's revisions in the order the loop would see them, so the old size of
+    every revision is just the previous rev_len in the sorted column (or 0 at the first
+    revision of a page).  the deltas are then summed per cohort and day in one groupby"""
+    order = np.argsort(revs['rev_page'].values, kind='mergesort')
+    page = revs['rev_page'].values[order]
+    size = revs['rev_len'].values[order]
+    # uint32 sizes from the column cache would wrap around on subtraction
+    size = size.astype(np.promote_types(size.dtype, np.int64))
+
+    old_size = np.zeros_like(size)
+    old_size[1:] = size[:-1]
+    first_rev = np.ones(len(page), dtype=bool)
+    first_rev[1:] = page[1:] != page[:-1]
+    old_size[first_rev] = 0
+
+    deltas = pd.DataFrame({'cohort' : revs['cohort'].values[order],
+                           'date' : mwtime.rev_days(revs)[order],
+                           'delta' : size - old_size})
+    totals = deltas.groupby(['cohort', 'date'])['delta'].sum().reset_index()
+    return aggregate.size_frames(totals)
+
+size_engines = {'vectorized' : get_size,
+                'loop' : get_size_loop}
+
+def write_limn(ds, basedir):
+    with instrument.stage('limn_write', len(ds.data)):
+        ds.write(basedir)
+        ds.write_graph(basedir=basedir)
+
 def make_bytes_graphs(dfs, lang, basedir):
     # index on dates
 
     date_dfs = {}
     for cohort, df in dfs.items():
-        df['date'] = pd.to_datetime(df['date'])
         df = df.set_index('date')
         date_dfs[cohort] = df
 
@@ -194,15 +253,13 @@ def make_bytes_graphs(dfs, lang, basedir):
     # make daily size graph
 
     ds_daily = limnpy.DataSource('%s_bytes_daily' % lang, '%sWP Bytes Daily' % lang.upper(), full_daily)
-    ds_daily.write(basedir)
-    ds_daily.write_graph(basedir=basedir)
+    write_limn(ds_daily, basedir)
 
     # make monthly size graph
     full_monthly = full_daily.resample('1M')
 
     ds_monthly = limnpy.DataSource('%s_bytes_monthly' % lang, '%sWP Bytes Monthly' % lang.upper(), full_monthly)
-    ds_monthly.write(basedir)
-    ds_monthly.write_graph(basedir=basedir)
+    write_limn(ds_monthly, basedir)
 
     # merge daily bytes added (deltas) and write csvs
     full_delta_daily = pd.DataFrame({cohort : df['delta'].asfreq('1D').fillna(0.0) for cohort, df in date_dfs.items()})
@@ -213,34 +270,26 @@ def make_bytes_graphs(dfs, lang, basedir):
     
     # make daily bytes added (deltas) graph
     ds_delta_daily = limnpy.DataSource('%s_bytes_added_daily' % lang, '%sWP Bytes Added Daily' % lang.upper(), full_delta_daily)
-    ds_delta_daily.write(basedir)
-    ds_delta_daily.write_graph(basedir=basedir)
+    write_limn(ds_delta_daily, basedir)
     
     # make monthly bytes added (deltas) graph
     delta_monthly = full_delta_daily.resample(rule='M', how='sum', label='right')
     ds_delta_monthly = limnpy.DataSource('%s_bytes_added_monthly' % lang, '%sWP Bytes Added Monthly' % lang.upper(), delta_monthly)
-    ds_delta_monthly.write(basedir)
-    ds_delta_monthly.write_graph(basedir=basedir)
+    write_limn(ds_delta_monthly, basedir)
    
 
 def make_rev_graphs(revs, lang, basedir):
-    revs = copy.deepcopy(revs) 
-    #for size, ts, page_id, user_id, cohort in revs.itertuples(index=False):
-    date_parser = lambda s : datetime.datetime.strptime(str(int(s))[:len('YYYYMMDD')], '%Y%m%d')
-    revs['rev_timestamp'] = revs['rev_timestamp'].map(date_parser)
-    counts = pd.DataFrame({'revisions' : revs.groupby(['rev_timestamp','cohort']).size()})
-    counts = counts.reset_index().rename({'rev_timestamp' : 'date'})
-    counts = counts.pivot(index='rev_timestamp', columns='cohort', values='revisions')
-    counts['total'] = counts.sum(axis=1)
+    counts = revs.groupby([revs['cohort'].values, mwtime.rev_days(revs)]).size()
+    write_rev_graphs(aggregate.pivot_counts(counts), lang, basedir)
+
+def write_rev_graphs(counts, lang, basedir):
     print counts
     ds_rev_daily = limnpy.DataSource('%s_revs_daily' % lang, '%sWP Daily Revisions' % lang.upper(), counts)
-    ds_rev_daily.write(basedir)
-    ds_rev_daily.write_graph(basedir=basedir)
+    write_limn(ds_rev_daily, basedir)
 
     counts_monthly = counts.resample(rule='M', how='sum', label='right')
     ds_rev_monthly = limnpy.DataSource('%s_revs_monthly' % lang, '%sWP Monthly Revisions' % lang.upper(), counts_monthly)
-    ds_rev_monthly.write(basedir)
-    ds_rev_monthly.write_graph(basedir=basedir)
+    write_limn(ds_rev_monthly, basedir)
 
 
 def load_lang_file(f):
@@ -252,30 +301,164 @@ def parse_args():
     group.add_argument('-l', '--language', dest='languages', nargs=1, help='single language id (ie.e en, de, fr, ar)')
     group.add_argument('-f', '--langfile', dest='languages', type=load_lang_file, help='file containing list of langauge ids')
     parser.add_argument('-o', '--basedir', default='data', help='location for limn graphs')
+    parser.add_argument('--cache_format', choices=caches.FORMATS, default='columns',
+                        help='on-disk format for the revision, page and bot caches.  existing csv caches are converted to columns automatically')
+    parser.add_argument('--size_engine', choices=size_engines.keys(), default='vectorized',
+                        help='implementation of get_size to use.  loop is the original per-revision reference implementation')
+    parser.add_argument('-n', '--namespaces', type=int, nargs='+', default=[0],
+                        help='namespaces to which revisions are restricted')
+    parser.add_argument('--server_filter', action='store_true', default=False,
+                        help='restrict revisions to --namespaces with a page join in the database instead of fetching the page table and merging in pandas')
+    parser.add_argument('--server_bots', action='store_true', default=False,
+                        help='flag bot revisions with a user_groups join in the database instead of fetching the bot table')
+    parser.add_argument('--streaming', action='store_true', default=False,
+                        help='aggregate the revision cache chunk by chunk instead of loading it into memory')
+    parser.add_argument('--chunksize', type=int, default=1000000,
+                        help='number of revisions per chunk in --streaming mode')
+    parser.add_argument('--checkpoint', action='store_true', default=False,
+                        help='save the per page sizes and daily totals after a --streaming run and resume from them on the next, so that only new revisions are processed.  implies --streaming')
+    parser.add_argument('--report',
+                        help='file to write per language, per stage timings, row counts, peak RSS and fetch latencies to.  written as csv if the name ends in .csv, json otherwise')
+    parser.add_argument('--profile_stage',
+                        help='run the named stage (e.g. get_size, fetch_revisions) under cProfile and dump the profile to <lang>.<stage>.prof')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='number of languages to process concurrently')
+    parser.add_argument('--shard_limit', type=int, default=4,
+                        help='maximum number of languages processed concurrently against any one database shard')
     return vars(parser.parse_args())
 
-def main():
-    opts = parse_args()
-    start_date = datetime.date(year=1999, month=1, day=1)
-    for lang in opts['languages']:
-        try:
-            cur = get_cur(lang)
-
-            rev = get_rev(lang, start_date, cur)
-
-            bots = get_bots(lang, cur)
-            page = get_page(lang, cur)
+LangResult = namedtuple('LangResult', ['lang', 'shard', 'ok', 'elapsed', 'error', 'stages'])
 
-            rev = filter_revs_ns(rev, page, [0])
+def process_lang(lang, opts):
+    start_date = datetime.date(year=1999, month=1, day=1)
+    namespaces = opts['namespaces'] if opts['server_filter'] else None
+    page = bots = None
+    with pool.connection(lang) as conn:
+        cur = conn.cursor()
+        with instrument.stage('fetch_revisions') as rec:
+            cache = update_rev_cache(lang, start_date, cur, opts['cache_format'],
+                                     namespaces=namespaces, bot_flag=opts['server_bots'])
+            rec['rows_out'] = caches.read_manifest(cache)['fetched']
+        if not opts['streaming']:
+            with instrument.stage('load_revisions') as rec:
+                rev = load_rev(cache, bot_flag=opts['server_bots'])
+                rec['rows_out'] = len(rev)
+        if not opts['server_filter']:
+            with instrument.stage('load_page') as rec:
+                page = get_page(lang, cur, opts['cache_format'])
+                rec['rows_out'] = len(page)
+        if not opts['server_bots']:
+            with instrument.stage('load_bots') as rec:
+                bots = get_bots(lang, cur, opts['cache_format'])
+                rec['rows_out'] = len(bots)
+        cur.close()
+
+    if opts['streaming']:
+        process_stream(cache, page, bots, lang, opts)
+        return
+
+    if not opts['server_filter']:
+        with instrument.stage('filter_ns', len(rev)) as rec:
+            rev = filter_revs_ns(rev, page, opts['namespaces'])
+            rec['rows_out'] = len(rev)
+    if not opts['server_bots']:
+        with instrument.stage('tag_bots', len(rev)) as rec:
             rev = tag_bots(rev, bots)
-            dfs = get_size(rev)
-        
-            make_rev_graphs(rev, lang, opts['basedir'])
-            make_bytes_graphs(dfs, lang, opts['basedir'])
+            rec['rows_out'] = len(rev)
+    with instrument.stage('get_size', len(rev)) as rec:
+        dfs = size_engines[opts['size_engine']](rev)
+        size_rows = sum(len(df) for df in dfs.values())
+        rec['rows_out'] = size_rows
+
+    with instrument.stage('rev_graphs', len(rev)):
+        make_rev_graphs(rev, lang, opts['basedir'])
+    with instrument.stage('bytes_graphs', size_rows):
+        make_bytes_graphs(dfs, lang, opts['basedir'])
+
+def process_stream(cache, page, bots, lang, opts):
+    """bounded memory equivalent of the filter / tag / size / graph steps of process_lang,
+    which pushes the revision cache through an aggregate.RevisionAggregator chunk by chunk"""
+    agg = aggregate.RevisionAggregator(None if opts['server_filter'] else opts['namespaces'], page, bots)
+
+    start = 0
+    checkpoint = '%s.checkpoint' % cache.path
+    # a checkpoint is only valid against the cache it was built from and the same filters
+    meta = {'cache_created' : caches.read_manifest(cache).get('created'),
+            'namespaces' : opts['namespaces'],
+            'server_filter' : opts['server_filter'],
+            'server_bots' : opts['server_bots']}
+    if opts['checkpoint']:
+        start = agg.restore(checkpoint, meta)
+
+    with instrument.stage('stream_aggregate') as rec:
+        for chunk in cache.iter_chunks(opts['chunksize'], start):
+            agg.add(chunk)
+            print 'aggregated %d revisions' % agg.rows_in
+        rec['rows_in'] = agg.rows_in
+        rec['rows_out'] = agg.rows_out
+    print 'filtered from %d to %d revs by restricting to ns: %s' % (agg.rows_in, agg.rows_out, opts['namespaces'])
+    if agg.out_of_order:
+        print 'WARNING: %d revisions are out of timestamp order in %s, bytes graphs may differ from the in-memory path' % (agg.out_of_order, cache.path)
+    if opts['checkpoint'] and agg.deltas is not None:
+        meta['rows'] = start + agg.rows_in
+        agg.save(checkpoint, meta)
+
+    with instrument.stage('rev_graphs', agg.rows_out):
+        write_rev_graphs(aggregate.pivot_counts(agg.count_totals()), lang, opts['basedir'])
+    with instrument.stage('bytes_graphs'):
+        make_bytes_graphs(aggregate.size_frames(agg.size_totals()), lang, opts['basedir'])
+
+def run_lang(lang, opts):
+    """runs process_lang, catching any failure so that one broken wiki can't take down the
+    rest of the run (or a pool worker)"""
+    start = time.time()
+    report = instrument.start(lang, opts['profile_stage'])
+    try:
+        process_lang(lang, opts)
+        return LangResult(lang, get_cluster(lang), True, time.time() - start, None, report.stages)
+    except Exception:
+        error = traceback.format_exc()
+        print 'failed to process %s:\n%s' % (lang, error)
+        return LangResult(lang, get_cluster(lang), False, time.time() - start, error, report.stages)
+
+def lang_failed(lang, error, elapsed):
+    """stands in for the result of a run_lang which raised or whose worker died"""
+    print 'failed to process %s:\n%s' % (lang, error)
+    return LangResult(lang, get_cluster(lang), False, elapsed, error, [])
+
+def run_parallel(langs, opts):
+    """runs the languages on a pool of opts['processes'] workers, never running more than
+    opts['shard_limit'] languages against the same database shard at once.  languages
+    with a dedicated entry in cluster_mapping are the big wikis, so they are started first
+    to keep them off the critical path"""
+    pending = sorted(langs, key=lambda lang : '%swiki' % lang not in cluster_mapping)
+    results = []
+    for lang, result in dbpool.map_sharded(run_lang, pending, (opts,), opts['processes'], opts['shard_limit'], lang_failed):
+        results.append(result)
+        print 'finished %s in %.1fs (%d of %d)' % (result.lang, result.elapsed, len(results), len(langs))
+    return results
+
+def print_summary(results):
+    print '%-15s %-6s %-8s %10s' % ('lang', 'shard', 'status', 'seconds')
+    for result in sorted(results, key=lambda r : -r.elapsed):
+        print '%-15s %-6s %-8s %10.1f' % (result.lang, result.shard, 'ok' if result.ok else 'FAILED', result.elapsed)
+    failed = [result.lang for result in results if not result.ok]
+    print '%d languages succeeded, %d failed: %s' % (len(results) - len(failed), len(failed), ', '.join(failed))
 
-        finally:
-            print 'closing cursor'
-            cur.close()
+def main():
+    opts = parse_args()
+    if opts['checkpoint']:
+        opts['streaming'] = True
+    if opts['processes'] > 1:
+        results = run_parallel(opts['languages'], opts)
+    else:
+        results = [run_lang(lang, opts) for lang in opts['languages']]
+    pool.close()
+    print_summary(results)
+    if opts['report']:
+        instrument.write_report([rec for result in results for rec in result.stages], opts['report'])
+    if not all(result.ok for result in results):
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,53 @@
+"""
+checks that the size engines and the streaming aggregator agree on synthetic data:
+
+    py.test test_get_size.py
+"""
+import numpy as np
+import pandas as pd
+
+import process
+import aggregate
+import benchmark
+
+
+def tagged_revs(n_revs, seed):
+    rev, page, bots = benchmark.synthesize(n_revs, seed)
+    rev['cohort'] = np.where(rev['rev_user'].isin(bots['ug_user']), 'bot', 'Other')
+    assert rev['rev_len'].dtype == np.uint32
+    assert set(rev['cohort']) == set(['Other', 'bot'])
+    return rev, page, bots
+
+def assert_same_sizes(dfs, expected):
+    assert sorted(dfs) == sorted(expected)
+    for cohort in expected:
+        df, other = dfs[cohort], expected[cohort]
+        assert len(df) == len(other), cohort
+        assert (pd.to_datetime(df['date']).values == pd.to_datetime(other['date']).values).all(), cohort
+        assert (df['delta'].values == other['delta'].values).all(), cohort
+        assert (df['size'].values == other['size'].values).all(), cohort
+
+def test_vectorized_matches_loop():
+    for seed in range(3):
+        rev, page, bots = tagged_revs(20000, seed)
+        assert_same_sizes(process.get_size(rev), process.get_size_loop(rev))
+
+def test_shrinking_pages():
+    # uint32 sizes must not wrap around when a revision makes a page smaller
+    rev = pd.DataFrame({'rev_len' : np.array([100, 40, 0, 70], dtype=np.uint32),
+                        'rev_timestamp' : [20120101000000, 20120101120000, 20120102000000, 20120103000000],
+                        'rev_page' : np.array([1, 1, 2, 1], dtype=np.uint32),
+                        'rev_user' : np.array([1, 2, 1, 3], dtype=np.uint32),
+                        'cohort' : ['Other', 'bot', 'Other', 'Other']})
+    for dfs in [process.get_size(rev), process.get_size_loop(rev)]:
+        assert list(dfs['bot']['delta']) == [-60]
+        assert list(dfs['Other']['size']) == [100, 100, 130]
+
+def test_aggregator_matches_loop():
+    rev, page, bots = tagged_revs(20000, 0)
+    agg = aggregate.RevisionAggregator(bots=bots)
+    raw = rev[['rev_len', 'rev_timestamp', 'rev_page', 'rev_user']]
+    for start in range(0, len(raw), 3000):
+        agg.add(raw.iloc[start:start + 3000])
+    assert agg.out_of_order == 0
+    assert_same_sizes(aggregate.size_frames(agg.size_totals()), process.get_size_loop(rev))
@@ -0,0 +1,103 @@
+"""
+maps the local editor ids of a wiki to global (centralauth) account ids, so that someone
+editing ten wikis of a group is counted once rather than ten times.
+
+centralauth only knows accounts by name, and lives on a different cluster to most wikis,
+so the join can not happen in a single query.  instead both sides are pulled with the
+name hashed on the server (the first 64 bits of its md5), and joined here on the hash
+with sorted arrays:
+
+    wiki         user_id,  hash(user_name)
+    centralauth  gu_id,    hash(gu_name)    for the accounts attached on that wiki
+
+the mapping of a wiki is saved as <lang>.global_ids.npz holding local_ids (sorted) and
+the matching global_ids.  local accounts which are not attached to a global account can
+not be matched to anyone else, so they are counted as separate editors.
+"""
+import os
+
+import numpy as np
+
+import atomic
+import idsets
+
+# first 64 bits of the md5 of a name, as an unsigned integer
+NAME_HASH = "CAST(CONV(LEFT(MD5(%s), 16), 16, 10) AS UNSIGNED)"
+
+LOCAL_USERS_QUERY = """SELECT user_id, %s FROM user""" % (NAME_HASH % 'user_name')
+
+GLOBAL_USERS_QUERY = """SELECT gu_id, %s
+                        FROM localuser
+                        JOIN globaluser ON gu_name = lu_name
+                        WHERE lu_wiki = %%s""" % (NAME_HASH % 'gu_name')
+
+
+def fetch_pairs(cur, query, args=None, batch_size=1000000):
+    """streams the (id, name hash) rows of query into a uint32 and a uint64 array"""
+    cur.execute(query, args)
+    ids, hashes = [], []
+    while True:
+        res = cur.fetchmany(batch_size)
+        if not res:
+            break
+        ids.append(np.fromiter((row[0] for row in res), dtype=idsets.ID_DTYPE, count=len(res)))
+        hashes.append(np.fromiter((row[1] for row in res), dtype=np.uint64, count=len(res)))
+    if not ids:
+        return np.zeros(0, dtype=idsets.ID_DTYPE), np.zeros(0, dtype=np.uint64)
+    return np.concatenate(ids), np.concatenate(hashes)
+
+def fetch_local_users(cur):
+    return fetch_pairs(cur, LOCAL_USERS_QUERY)
+
+def fetch_global_users(cur, lang):
+    """cur should be connected to centralauth"""
+    return fetch_pairs(cur, GLOBAL_USERS_QUERY, ('%swiki' % lang,))
+
+def merge_join(left, right):
+    """returns (left_idx, right_idx) of the keys in both left and right.  right must be
+    sorted and unique, and so must left for the result to come out sorted"""
+    if not len(left) or not len(right):
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+    right_idx = np.searchsorted(right, left)
+    found = right_idx < len(right)
+    found[found] = right[right_idx[found]] == left[found]
+    return np.flatnonzero(found), right_idx[found]
+
+def build_mapping(local_ids, local_hashes, global_ids, global_hashes):
+    """joins the local and global accounts on the name hash.  returns (local_ids,
+    global_ids) of the attached accounts, sorted by local id"""
+    local_order = np.argsort(local_hashes, kind='mergesort')
+    global_order = np.argsort(global_hashes, kind='mergesort')
+    li, gi = merge_join(local_hashes[local_order], global_hashes[global_order])
+    local_ids = local_ids[local_order[li]]
+    global_ids = global_ids[global_order[gi]]
+    order = np.argsort(local_ids, kind='mergesort')
+    return local_ids[order], global_ids[order]
+
+def map_ids(ids, mapping):
+    """maps an idset of local editor ids to global ids.  returns (global idset, number of
+    editors with no global account).  anonymous edits (id 0) are dropped"""
+    local_ids, global_ids = mapping
+    ids = np.asarray(ids)
+    ids = ids[ids > 0]
+    li, mi = merge_join(ids, local_ids)
+    return idsets.as_idset(global_ids[mi]), len(ids) - len(li)
+
+def mapping_path(lang, outdir):
+    return os.path.join(outdir, '%s.global_ids.npz' % lang)
+
+def save(mapping, path):
+    atomic.save(path, lambda tmp_path : np.savez(tmp_path, local_ids=mapping[0], global_ids=mapping[1]))
+
+def load(path):
+    data = np.load(path)
+    return data['local_ids'], data['global_ids']
+
+def map_group(sets, outdir):
+    """maps the {lang : local idset} of a group to global ids with the saved mappings.
+    returns ({lang : global idset}, {lang : number of editors with no global account})"""
+    global_sets, unattached = {}, {}
+    for lang, ids in sets.items():
+        global_sets[lang], unattached[lang] = map_ids(ids, load(mapping_path(lang, outdir)))
+    return global_sets, unattached
@@ -0,0 +1,173 @@
+"""
+HyperLogLog sketches of the editors of a wiki, one per month.  a sketch is a fixed size
+array of 2**p uint8 registers which estimates the number of distinct ids added to it with
+a relative standard error of about 1.04 / sqrt(2**p), whatever that number is.  sketches
+merge with an elementwise max, so the monthly sketches of a wiki combine into any time
+range, and those of several wikis into any language group, without going back to the ids.
+
+the sketches of a wiki are saved as <lang>.editor_hll.p<p>.npz, so that sketches of
+another precision are never mistaken for them, holding
+
+    months      int32 YYYYMM of each row, ascending
+    registers   uint8 (len(months), 2**p)
+
+note that rev_user is a local id, so by default the ids of each wiki are hashed with a
+per-wiki salt: a merged group then counts (wiki, editor) pairs.  given the global id
+mapping of the wiki (see globalids.py) attached accounts are hashed as their global id
+with salt 0 instead, so that the sketches dedup editors across wikis.
+"""
+import os
+import math
+import zlib
+
+import numpy as np
+
+import atomic
+import globalids
+
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+def error_to_precision(error):
+    """the smallest p whose standard error is at most error"""
+    p = int(math.ceil(math.log((1.04 / error) ** 2, 2)))
+    return min(max(p, MIN_PRECISION), MAX_PRECISION)
+
+def precision_error(p):
+    return 1.04 / math.sqrt(2 ** p)
+
+def lang_salt(lang):
+    return zlib.crc32(lang) & 0xffffffff
+
+_U64 = np.uint64
+
+def hash_ids(ids, salt=0):
+    """64 bit hashes (the splitmix64 finalizer) of uint32 ids, with salt in the high word"""
+    x = np.asarray(ids, dtype=np.uint64) | (_U64(salt) << _U64(32))
+    x = x + _U64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> _U64(30))) * _U64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> _U64(27))) * _U64(0x94D049BB133111EB)
+    return x ^ (x >> _U64(31))
+
+def _bit_length(w):
+    # frexp is exact for ints below 2**53, so take the two 32 bit halves separately
+    hi = np.frexp((w >> _U64(32)).astype(np.float64))[1]
+    lo = np.frexp((w & _U64(0xffffffff)).astype(np.float64))[1]
+    return np.where(hi > 0, hi + 32, lo)
+
+def register_updates(hashes, p):
+    """returns (register index, rank) of each hash: the top p bits pick the register and
+    the rank is the position of the first 1 bit in the rest"""
+    idx = (hashes >> _U64(64 - p)).astype(np.intp)
+    rest = hashes << _U64(p)
+    rank = np.minimum(64 - _bit_length(rest) + 1, 64 - p + 1).astype(np.uint8)
+    return idx, rank
+
+def estimate(registers):
+    """estimated distinct count of each sketch in registers (one per row, or a single
+    sketch), with the linear counting correction for small cardinalities"""
+    registers = np.atleast_2d(registers)
+    m = registers.shape[1]
+    alpha = {16 : 0.673, 32 : 0.697, 64 : 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    raw = alpha * m * m / np.exp2(-registers.astype(np.float64)).sum(axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1).astype(np.float64))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+def merge(sketches):
+    """merges a list of register arrays of the same precision"""
+    return np.maximum.reduce(sketches)
+
+
+class MonthlySketches(object):
+    """the editor sketches of one wiki (or a merged group), keyed by YYYYMM"""
+
+    def __init__(self, p, months=None, registers=None):
+        self.p = p
+        self.months = np.zeros(0, dtype=np.int32) if months is None else np.asarray(months, dtype=np.int32)
+        self.registers = np.zeros((len(self.months), 2 ** p), dtype=np.uint8) if registers is None else registers
+
+    def rows(self, months):
+        """row of each of months, adding empty sketches for months not seen yet"""
+        new = np.setdiff1d(months, self.months)
+        if len(new):
+            all_months = np.union1d(self.months, new).astype(np.int32)
+            registers = np.zeros((len(all_months), 2 ** self.p), dtype=np.uint8)
+            registers[np.searchsorted(all_months, self.months)] = self.registers
+            self.months, self.registers = all_months, registers
+        return np.searchsorted(self.months, months)
+
+    def add(self, ids, months, salt=0):
+        """adds editor ids, each active in the matching YYYYMM of months"""
+        idx, rank = register_updates(hash_ids(ids, salt), self.p)
+        rows = self.rows(np.asarray(months, dtype=np.int32))
+        flat = self.registers.reshape(-1)
+        np.maximum.at(flat, rows * (2 ** self.p) + idx, rank)
+
+    def update(self, other):
+        """merges other into self"""
+        if other.p != self.p:
+            raise ValueError('cannot merge sketches of precision %d and %d' % (self.p, other.p))
+        rows = self.rows(other.months)
+        self.registers[rows] = np.maximum(self.registers[rows], other.registers)
+
+    def between(self, start=None, end=None):
+        """the merged sketch of the months in [start, end]"""
+        mask = np.ones(len(self.months), dtype=bool)
+        if start is not None:
+            mask &= self.months >= start
+        if end is not None:
+            mask &= self.months <= end
+        if not mask.any():
+            return np.zeros(2 ** self.p, dtype=np.uint8)
+        return self.registers[mask].max(axis=0)
+
+    def estimates(self):
+        return estimate(self.registers) if len(self.months) else np.zeros(0)
+
+
+def sketch_path(lang, outdir, p):
+    return os.path.join(outdir, '%s.editor_hll.p%d.npz' % (lang, p))
+
+def fetch_sketches(cur, p, salt=0, mapping=None, batch_size=1000000):
+    """streams the distinct (editor, month) pairs of the logged in users of the wiki cur is
+    connected to into monthly sketches.  cur should be a server side (SS) cursor.  with
+    the (local_ids, global_ids) mapping of the wiki, attached editors are added by their
+    global id"""
+    cur.execute("""SELECT DISTINCT rev_user, LEFT(rev_timestamp, 6) FROM revision WHERE rev_user > 0""")
+    sketches = MonthlySketches(p)
+    while True:
+        res = cur.fetchmany(batch_size)
+        if not res:
+            break
+        ids = np.fromiter((row[0] for row in res), dtype=np.uint32, count=len(res))
+        months = np.fromiter((int(row[1]) for row in res), dtype=np.int32, count=len(res))
+        if mapping is None:
+            sketches.add(ids, months, salt)
+            continue
+        attached, mi = globalids.merge_join(ids, mapping[0])
+        sketches.add(mapping[1][mi], months[attached], 0)
+        unattached = np.ones(len(ids), dtype=bool)
+        unattached[attached] = False
+        sketches.add(ids[unattached], months[unattached], salt)
+    return sketches
+
+def save(sketches, path):
+    atomic.save(path, lambda tmp_path : np.savez_compressed(tmp_path, p=sketches.p, months=sketches.months,
+                                                            registers=sketches.registers))
+
+def load(path):
+    data = np.load(path)
+    return MonthlySketches(int(data['p']), data['months'], data['registers'])
+
+def merge_group(paths):
+    """merges the saved sketches of a group of wikis"""
+    group = None
+    for path in paths:
+        sketches = load(path)
+        if group is None:
+            group = sketches
+        else:
+            group.update(sketches)
+    return group
@@ -0,0 +1,77 @@
+"""
+compact editor id sets.  the ids of a wiki are streamed off a server side cursor into a
+sorted, de-duplicated uint32 array (4 bytes per editor rather than a python int in a
+set) and saved as <lang>.editor_ids.npy, which loads memory mapped.  the set operations
+below work directly on such arrays with numpy's sorted-array routines.
+
+note that rev_user is a local id: the same number on two wikis is in general a different
+person, so cross-wiki overlaps are only meaningful once the ids of each wiki have been
+mapped to global (centralauth) ids.
+"""
+import os
+
+import numpy as np
+
+import atomic
+
+ID_DTYPE = np.uint32
+
+
+def fetch_ids(cur, batch_size=1000000):
+    """streams the distinct ids of the logged in editors of the wiki cur is connected to
+    into a sorted uint32 array, leaving out the anonymous id 0.  cur should be a server
+    side (SS) cursor so that only one batch is ever held as python objects"""
+    cur.execute("""SELECT DISTINCT(rev_user) FROM revision WHERE rev_user > 0 ORDER BY rev_user""")
+    chunks = []
+    while True:
+        res = cur.fetchmany(batch_size)
+        if not res:
+            break
+        chunks.append(np.fromiter((row[0] for row in res), dtype=ID_DTYPE, count=len(res)))
+    ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=ID_DTYPE)
+    return as_idset(ids)
+
+def as_idset(ids):
+    """returns ids as a sorted, de-duplicated uint32 array, skipping the sort when the
+    ids already are (as they come back from fetch_ids)"""
+    ids = np.asarray(ids, dtype=ID_DTYPE)
+    if len(ids) > 1 and not (ids[1:] > ids[:-1]).all():
+        ids = np.unique(ids)
+    return ids
+
+def idset_path(lang, outdir):
+    return os.path.join(outdir, '%s.editor_ids.npy' % lang)
+
+def save(ids, path):
+    """saves atomically, so that path only ever holds a complete set"""
+    atomic.save(path, lambda tmp_path : np.save(tmp_path, ids))
+
+def load(path):
+    return np.load(path, mmap_mode='r')
+
+
+def overlap(a, b):
+    """ids in both a and b"""
+    return np.intersect1d(a, b, assume_unique=True)
+
+def union(idsets):
+    if not idsets:
+        return np.zeros(0, dtype=ID_DTYPE)
+    return np.unique(np.concatenate(idsets))
+
+def only_in(a, others):
+    """ids in a which are in none of others"""
+    return np.setdiff1d(a, union(others), assume_unique=True)
+
+def membership_counts(idsets):
+    """returns (ids, counts): every id in any of idsets, and the number of sets it is in"""
+    ids = np.concatenate(idsets) if idsets else np.zeros(0, dtype=ID_DTYPE)
+    ids.sort(kind='mergesort')
+    starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+    counts = np.diff(np.concatenate([starts, [len(ids)]]))
+    return ids[starts], counts
+
+def in_at_least(idsets, n):
+    """ids which appear in at least n of idsets, e.g. n=2 for editors of more than one wiki"""
+    ids, counts = membership_counts(idsets)
+    return ids[counts >= n]
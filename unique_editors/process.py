@@ -1,31 +1,158 @@
-import MySQLdb
-
-# wikimedia cluster information extracted from http://noc.wikimedia.org/conf/highlight.php?file=db.php
-# NOTE: The default mapping is 's3'
-cluster_mapping = {'enwiki':'s1','bgwiki':'s2','bgwiktionary':'s2','cswiki':'s2','enwikiquote':'s2','enwiktionary':'s2','eowiki':'s2','fiwiki':'s2','idwiki':'s2','itwiki':'s2','nlwiki':'s2','nowiki':'s2','plwiki':'s2','ptwiki':'s2','svwiki':'s2','thwiki':'s2','trwiki':'s2','zhwiki':'s2','commonswiki':'s4','dewiki':'s5','frwiki':'s6','jawiki':'s6','ruwiki':'s6','eswiki':'s7','huwiki':'s7','hewiki':'s7','ukwiki':'s7','frwiktionary':'s7','metawiki':'s7','arwiki':'s7','centralauth':'s7','cawiki':'s7','viwiki':'s7','fawiki':'s7','rowiki':'s7','kowiki':'s7'}
-
-# new CNAME system.
-# TODO: abstract mapping to a use just number and then autogenerate CNAMES aliases
-db_mapping = {'s1':'s1-analytics-slave.eqiad.wmnet', 
-	      's2':'s2-analytics-slave.eqiad.wmnet', 
-	      's3':'s3-analytics-slave.eqiad.wmnet',
-	      's4':'s4-analytics-slave.eqiad.wmnet',
-	      's5':'s5-analytics-slave.eqiad.wmnet', 
-	      's6':'s6-analytics-slave.eqiad.wmnet',
-	      's7':'s7-analytics-slave.eqiad.wmnet', 
-	      }
-
-def get_host_name(lang):
-	'''Returns the host name for the wiki project lang'''
-	cluster = cluster_mapping.get('%swiki' % lang, 's3')
-        return '%s-analytics-slave.eqiad.wmnet' % cluster
+import os
+import sys
+import time
+import argparse
+import traceback
+from operator import itemgetter
+
+from MySQLdb.cursors import SSCursor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dbpool
+from dbpool import cluster_mapping, get_cluster
+import idsets
+import hll
+import globalids
+
+# each worker process keeps its connections across the languages it is handed
+pool = dbpool.ConnectionPool(cursorclass=SSCursor)
+
+def load_lang_file(f):
+    return map(itemgetter(0),map(str.split, filter(lambda l: not l.startswith('#') and len(l) > 0, open(f).read().split('\n'))))
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--langfile', dest='languages', type=load_lang_file, default='../data/all_ids.tsv',
+                        help='file containing list of language ids to extract editor ids for')
+    parser.add_argument('-o', '--outdir', default='data', help='directory for the <lang>.editor_ids.npy files')
+    parser.add_argument('-g', '--group', type=load_lang_file,
+                        help='file of language ids (e.g. ../data/indic_lang_ids.tsv) to print overlap statistics for')
+    parser.add_argument('-p', '--processes', type=int, default=8,
+                        help='number of languages to extract concurrently')
+    parser.add_argument('--shard_limit', type=int, default=4,
+                        help='maximum number of languages extracted concurrently from any one database shard')
+    parser.add_argument('--refresh', action='store_true',
+                        help='extract languages again even if their output file already exists')
+    parser.add_argument('-s', '--sketch', action='store_true',
+                        help='store a HyperLogLog sketch of the editors per month (<lang>.editor_hll.p<p>.npz) instead of the exact ids')
+    parser.add_argument('-e', '--error', type=float, default=0.02,
+                        help='relative standard error of the sketches, which sets their size (2%% is 4KB per wiki and month)')
+    parser.add_argument('--global_ids', action='store_true',
+                        help='also map the local editor ids to centralauth accounts (<lang>.global_ids.npz), so that group '
+                        'counts and sketches count someone editing several wikis once')
+    return vars(parser.parse_args())
+
+def output_paths(lang, outdir, precision=None, global_ids=False):
+    paths = [hll.sketch_path(lang, outdir, precision) if precision else idsets.idset_path(lang, outdir)]
+    if global_ids:
+        paths.append(globalids.mapping_path(lang, outdir))
+    return paths
+
+def fetch_mapping(lang):
+    with pool.connection(lang) as conn:
+        cur = conn.cursor()
+        local_ids, local_hashes = globalids.fetch_local_users(cur)
+        cur.close()
+    with pool.connection(lang, db='centralauth') as conn:
+        cur = conn.cursor()
+        global_ids, global_hashes = globalids.fetch_global_users(cur, lang)
+        cur.close()
+    return globalids.build_mapping(local_ids, local_hashes, global_ids, global_hashes)
+
+def extract_lang(lang, outdir, precision=None, global_ids=False):
+    """saves the editor ids of lang, or its monthly sketches of the given precision, to its
+    own file, along with its global id mapping if asked for.  returns (lang, ok, n_editors
+    or the traceback, seconds) rather than raising, so that one failing wiki does not stop
+    the others"""
+    start = time.time()
+    try:
+        mapping = None
+        if global_ids:
+            mapping = fetch_mapping(lang)
+            globalids.save(mapping, globalids.mapping_path(lang, outdir))
+        with pool.connection(lang) as conn:
+            cur = conn.cursor()
+            if precision:
+                result = hll.fetch_sketches(cur, precision, hll.lang_salt(lang), mapping)
+            else:
+                result = idsets.fetch_ids(cur)
+            cur.close()
+        if precision:
+            hll.save(result, hll.sketch_path(lang, outdir, precision))
+            n_editors = int(hll.estimate(result.between())[0])
+        else:
+            idsets.save(result, idsets.idset_path(lang, outdir))
+            n_editors = len(result)
+        return lang, True, n_editors, time.time() - start
+    except Exception:
+        return lang, False, traceback.format_exc(), time.time() - start
+
+def extract(languages, outdir, processes=8, shard_limit=4, refresh=False, precision=None, global_ids=False):
+    """extracts every language which does not have its output files yet (or all of them
+    with refresh).  the files are written atomically, so an interrupted run just picks up
+    the languages it had not finished.  the big wikis go first as they set the length of
+    the run"""
+    pending = [lang for lang in languages
+               if refresh or not all(map(os.path.exists, output_paths(lang, outdir, precision, global_ids)))]
+    print 'extracting %d languages, %d already done' % (len(pending), len(languages) - len(pending))
+    pending.sort(key=lambda lang : '%swiki' % lang not in cluster_mapping)
+    results = []
+    for lang, result in dbpool.map_sharded(extract_lang, pending, (outdir, precision, global_ids), processes, shard_limit,
+                                           lambda lang, error, elapsed : (lang, False, error, elapsed)):
+        lang, ok, value, elapsed = result
+        if ok:
+            print '%s: %d editors in %.1fs (%d of %d)' % (lang, value, elapsed, len(results) + 1, len(pending))
+        else:
+            print 'failed to extract %s (%s):\n%s' % (lang, get_cluster(lang), value)
+        results.append(result)
+    failed = [r[0] for r in results if not r[1]]
+    print '%d languages extracted, %d failed: %s' % (len(results) - len(failed), len(failed), ', '.join(failed))
+    return failed
+
+def print_group_stats(group, outdir, global_ids=False):
+    sets = dict((lang, idsets.load(idsets.idset_path(lang, outdir))) for lang in group)
+    if global_ids:
+        # an editor with no global account can only be counted on their own wiki
+        global_sets, unattached = globalids.map_group(sets, outdir)
+        n_local = sum(int((ids > 0).sum()) for ids in sets.values())
+        n_people = len(idsets.union(global_sets.values())) + sum(unattached.values())
+        print 'logged in editors in group: %d local accounts, %d people' % (n_local, n_people)
+        print 'editors on more than one wiki in group: %d' % len(idsets.in_at_least(global_sets.values(), 2))
+        for lang, ids in sorted(global_sets.items()):
+            others = [other for other_lang, other in global_sets.items() if other_lang != lang]
+            print '%s: %d editors, %d only on %s' % (lang, len(ids) + unattached[lang],
+                                                     len(idsets.only_in(ids, others)) + unattached[lang], lang)
+        return
+    # local ids are only comparable within a wiki, so the overlaps below are of ids rather
+    # than of people
+    print 'local ids in group (not people, see --global_ids): %d' % len(idsets.union(sets.values()))
+    print 'local ids on more than one wiki in group: %d' % len(idsets.in_at_least(sets.values(), 2))
+    for lang, ids in sorted(sets.items()):
+        others = [other for other_lang, other in sets.items() if other_lang != lang]
+        print '%s: %d editors, %d ids only on %s' % (lang, len(ids), len(idsets.only_in(ids, others)), lang)
+
+def print_group_trend(group, outdir, precision):
+    """prints the estimated editors of the group per month, merged from the saved sketches"""
+    sketches = hll.merge_group([hll.sketch_path(lang, outdir, precision) for lang in group])
+    print 'editors in group (+/- %.1f%%): %d' % (100 * hll.precision_error(sketches.p), hll.estimate(sketches.between())[0])
+    for month, n_editors in zip(sketches.months, sketches.estimates()):
+        print '%d\t%d' % (month, n_editors)
 
 def main():
-    languages = map(str.strip(), open('all_ids.tsv').read().split('\n'))
-    ids = {}
-    for lang in languages:
-        host_name = get_host_name(lang)
-	db = MySQLdb.connect(host=host_name,read_default_file=os.path.expanduser('~/.my.cnf'), db='%swiki' % lang)
-        res = db.cursor().execute("""SELECT DISTINCT(rev_user) FROM revision""")
-        ids[lang] = set(map(itemgetter(0), res))
-    print ids
+    opts = parse_args()
+    if not os.path.isdir(opts['outdir']):
+        os.makedirs(opts['outdir'])
+    precision = hll.error_to_precision(opts['error']) if opts['sketch'] else None
+    failed = extract(opts['languages'], opts['outdir'], opts['processes'], opts['shard_limit'], opts['refresh'],
+                     precision, opts['global_ids'])
+    if opts['group']:
+        group = [lang for lang in opts['group'] if lang not in failed]
+        if opts['sketch']:
+            print_group_trend(group, opts['outdir'], precision)
+        else:
+            print_group_stats(group, opts['outdir'], opts['global_ids'])
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()